@@ -45,24 +45,227 @@ bl_info = {
     "description": "Assign bone colors by the rig layers they are on."
 }
 
-import bpy
+import bpy, hashlib, json
+import numpy as np
+from bpy.app.handlers import persistent
+
+def layer_matrix( obj ):
+    ''' Returns a ( bones, 32 ) boolean array of the layers each bone of the
+        rig is on, read in bulk '''
+    bones = obj.data.bones
+    flags = [ False ] * ( len( bones ) * 32 )
+    bones.foreach_get( 'layers', flags )
+
+    return np.array( flags, dtype = bool ).reshape( len( bones ), 32 )
+
 
 def find_active_layers( obj ):
-    ''' This function iterates over all bones in the rig, and returns a list of
-         all the layers on which these bones are located '''
+    ''' This function returns a list of all the layers on which the rig's
+         bones are located '''
+    return active_layers( layer_matrix( obj ) )
+
+
+def active_layers( layers ):
+    ''' Returns the layers of a layer matrix that hold at least one bone '''
+    return [ int( l ) for l in np.flatnonzero( layers.any( axis = 0 ) ) ]
+
+
+def layer_weights( rule, priority = '' ):
+    ''' Returns the score of each of the 32 layers under a resolution rule.
+        A bone on several layers goes to the group of its best scoring layer '''
+    if rule == 'LOWEST':
+        return np.arange( 32, 0, -1 )
+
+    weights = np.arange( 1, 33 )
+
+    if rule == 'PRIORITY':
+        # Listed layers beat all others, in list order. Unlisted layers fall
+        # back to the highest layer rule
+        listed = [
+            int( l ) for l in priority.replace( ',', ' ' ).split()
+            if l.isdigit() and int( l ) < 32
+        ]
+        for rank, l in enumerate( reversed( listed ) ):
+            weights[ l ] = 33 + rank
+
+    return weights
+
+
+def resolve_layers( obj, layers ):
+    ''' Returns the layer whose group each bone belongs to (-1 for bones on
+        no layer), as one argmax over the bones x 32 layer matrix '''
+    props  = obj.bonegroup_colors
+    scores = layers * layer_weights( props.resolution, props.priority )
+
+    resolved = np.argmax( scores, axis = 1 )
+    resolved[ ~layers.any( axis = 1 ) ] = -1
+
+    return resolved
+
+
+def bone_group_name( layer ):
+    ''' Returns the name of the bone group representing a rig layer '''
+    return 'bone_group_%02d' % layer
+
+
+def rig_hash( obj, layers = None ):
+    ''' Returns a hash identifying the rig by its bone names, the layers they
+        are on and the layer resolution rule. A preset stays valid as long as
+        this hash doesn't change '''
+    props = obj.bonegroup_colors
+    ident = hashlib.md5()
+
+    # Pack each bone's 32 layer flags into a single bitmask
+    if layers is None:
+        layers = layer_matrix( obj )
+    masks = layers.dot( 1 << np.arange( 32, dtype = np.int64 ) )
+
+    for bone, mask in zip( obj.data.bones, masks ):
+        ident.update( ( bone.name + ':' + str( mask ) + ';' ).encode() )
+
+    ident.update( ( props.resolution + ':' + props.priority ).encode() )
+
+    return ident.hexdigest()
+
+
+def compute_preset( obj ):
+    ''' Computes the layer -> group -> color assignment of the rig. Colors
+        of bone groups that already exist on the rig are kept '''
+    bgroups = obj.pose.bone_groups
+    groups  = {}
+    layers  = layer_matrix( obj )
+
+    for l in active_layers( layers ):
+        bgroup_name = bone_group_name( l )
+
+        color_set = 'DEFAULT'
+        colors    = []
+        if bgroup_name in bgroups:
+            g         = bgroups[ bgroup_name ]
+            color_set = g.color_set
+            colors    = [ list( g.colors.normal ),
+                          list( g.colors.select ),
+                          list( g.colors.active ) ]
+
+        groups[ bgroup_name ] = {
+            'color_set' : color_set,
+            'colors'    : colors,
+            'bones'     : []
+        }
+
+    # Every bone is assigned exactly once, to the layer the rule resolves
+    for bone, l in zip( obj.data.bones, resolve_layers( obj, layers ) ):
+        if l >= 0:
+            groups[ bone_group_name( l ) ]['bones'].append( bone.name )
+
+    return { 'hash' : rig_hash( obj, layers ), 'groups' : groups }
+
+
+def apply_preset( obj, preset ):
+    ''' Creates the preset's bone groups and assigns their bones in bulk,
+        without scanning the rig's layers '''
+    bgroups    = obj.pose.bone_groups
+    pose_bones = obj.pose.bones
+
+    for bgroup_name, group in preset['groups'].items():
+        if bgroup_name in bgroups:
+            g = bgroups[ bgroup_name ]
+        else:
+            g = bgroups.new( name = bgroup_name )
 
-    all_active_layers = []
+        g.color_set = group['color_set']
+        if group['colors']:
+            g.colors.normal, g.colors.select, g.colors.active = group['colors']
 
-    for bone in obj.data.bones:
-        # Find bone's active layers. An active layer has a True value.
-        i = 0
-        for l in bone.layers:
-            # Add an active layer's index to list if its not already there
-            if l and i not in all_active_layers:
-                all_active_layers.append( i )
-            i += 1
+        for bone in group['bones']:
+            pb = pose_bones.get( bone )
+            if pb:
+                pb.bone_group = g
 
-    return all_active_layers
+
+def store_preset( obj, preset ):
+    ''' Caches the preset by rig hash, and saves it on the armature data so
+        that files linking the rig can re-apply it '''
+    preset_cache[ preset['hash'] ] = preset
+
+    # Linked armature data is read only, the library file holds the preset
+    if obj.data.library is None:
+        obj.data[ 'bone_color_preset' ] = json.dumps( preset )
+
+
+def refresh_colors( obj, preset ):
+    ''' Updates the preset's colors from the rig's current bone groups '''
+    bgroups = obj.pose.bone_groups
+
+    for bgroup_name, group in preset['groups'].items():
+        if bgroup_name in bgroups:
+            g = bgroups[ bgroup_name ]
+            group['color_set'] = g.color_set
+            group['colors']    = [ list( g.colors.normal ),
+                                   list( g.colors.select ),
+                                   list( g.colors.active ) ]
+
+
+def color_bones_by_layer( armatures ):
+    ''' Creates bone groups by rig layers on one or more armature objects.
+        Doesn't depend on the context, so pipeline scripts can call it on
+        any armature '''
+    if isinstance( armatures, bpy.types.Object ):
+        armatures = [ armatures ]
+
+    for obj in armatures:
+        preset = compute_preset( obj )
+
+        apply_preset( obj, preset )
+        store_preset( obj, preset )
+
+
+# Presets computed in this session, keyed by rig hash. Rigs of the same
+# character share one entry, so a shot with many instances computes it once.
+preset_cache = {}
+
+@persistent
+def restore_presets( dummy ):
+    ''' Re-applies the stored bone color presets of all rigs in the file.
+        A rig is only rescanned when it changed since its preset was saved '''
+    for obj in bpy.data.objects:
+        if obj.type != 'ARMATURE' or not obj.pose:
+            continue
+
+        stored = obj.data.get( 'bone_color_preset' )
+        if not stored and not obj.bonegroup_colors.use_colors:
+            continue
+
+        h      = rig_hash( obj )
+        preset = preset_cache.get( h )
+
+        if preset is None and stored:
+            preset = json.loads( stored )
+            if preset['hash'] == h:
+                preset_cache[ h ] = preset
+            else:
+                preset = None
+
+        if preset is None:
+            preset = compute_preset( obj )
+            store_preset( obj, preset )
+
+        apply_preset( obj, preset )
+
+@persistent
+def save_presets( dummy ):
+    ''' Stores color changes made in the panel along with the presets '''
+    for obj in bpy.data.objects:
+        if obj.type != 'ARMATURE' or not obj.pose:
+            continue
+        if obj.data.library or not obj.bonegroup_colors.use_colors:
+            continue
+
+        stored = obj.data.get( 'bone_color_preset' )
+        if stored:
+            preset = json.loads( stored )
+            refresh_colors( obj, preset )
+            store_preset( obj, preset )
 
 
 class bone_colors( bpy.types.Panel ):
@@ -99,6 +302,11 @@ class bone_colors( bpy.types.Panel ):
         col.prop( color_props, "use_colors", "Create Color Groups by Rig Layer" )
 
         if color_props.use_colors:
+            # Group of bones on more than one layer
+            col.prop( color_props, "resolution" )
+            if color_props.resolution == 'PRIORITY':
+                col.prop( color_props, "priority" )
+
             group_names = sorted( [ g.name for g in bgroups ] )
             
             # each bone group gets a row where you can choose its color
@@ -126,44 +334,13 @@ class ColorBones( bpy.types.PropertyGroup ):
 
     def create_groups( self, context ):
         """ Creates bone groups by rig layers """
-        obj = bpy.context.object
+        obj = self.id_data
 
         # Exit and do not create groups if "use_colors" is set to False
         if self.use_colors == False:
             return None
-        
-        active_layers = find_active_layers( obj )
-
-        # Get existing bone group names  
-        bgroups = [ g.name for g in obj.pose.bone_groups ]
-        
-        for l in active_layers:
-            
-            # Make bone Group name from bone layer number
-            if l < 10:
-                bgroup_name = 'bone_group_0' + str(l)
-            else:
-                bgroup_name = 'bone_group_'  + str(l)
 
-            # Create a new bone group if it doesn't exist
-            if bgroup_name not in bgroups:
-                bpy.ops.pose.group_add()
-                obj.pose.bone_groups[-1].name = bgroup_name
-                
-            ## Add bones to this group (if they're on the appropriate layer )
-            
-            # Reference all the bones on this layer
-            layer_bones = [ b.name for b in obj.data.bones if b.layers[l] ]
-
-            """ Note that this addon will not work as expected if bones are on
-                more than one layer. The group representing the highest number
-                layer will contain a bone with more than one layer.
-            """
-
-            # Add bones to group
-            for bone in layer_bones:
-                pb = obj.pose.bones[ bone ]
-                pb.bone_group = obj.pose.bone_groups[ bgroup_name ]
+        color_bones_by_layer( obj )
             
         return None
 
@@ -174,12 +351,37 @@ class ColorBones( bpy.types.PropertyGroup ):
         update      = create_groups
     ) 
 
+    # Which group a bone on several layers is assigned to
+    resolution_items = [
+        ('HIGHEST',  'Highest layer', 'Group of the highest layer the bone is on'),
+        ('LOWEST',   'Lowest layer',  'Group of the lowest layer the bone is on'),
+        ('PRIORITY', 'Priority list', 'Group of the first listed layer the bone is on')
+    ]
+    resolution = bpy.props.EnumProperty(
+        name    = "Multi-layer bones",
+        items   = resolution_items,
+        default = 'HIGHEST',
+        update  = create_groups
+    )
+    priority = bpy.props.StringProperty(
+        name        = "Layer priority",
+        description = "Layers in order of priority, ex: 3, 0, 16",
+        default     = "",
+        update      = create_groups
+    )
+
 
 def register():
     bpy.utils.register_module(__name__)
 
     # Ref to prop group via dynamic object property
     bpy.types.Object.bonegroup_colors = bpy.props.PointerProperty( type = ColorBones )
+
+    bpy.app.handlers.load_post.append( restore_presets )
+    bpy.app.handlers.save_pre.append( save_presets )
     
 def unregister():
     bpy.utils.unregister_module(__name__)
+
+    bpy.app.handlers.load_post.remove( restore_presets )
+    bpy.app.handlers.save_pre.remove( save_presets )
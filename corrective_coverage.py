@@ -0,0 +1,400 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+#
+#  Author            : Tamir Lousky [ tlousky@gmail.com, tamir@pitchipoy.tv ]
+#
+#  Homepage(Wiki)    : http://bioblog3d.wordpress.com/
+#  Studio (sponsor)  : Pitchipoy Animation Productions (www.pitchipoy.tv)
+#
+#  Acknowledgements
+#  ================
+#
+
+bl_info = {
+    "name"       : "Corrective Coverage",
+    "author"     : "Tamir Lousky",
+    "version"    : (0, 0, 1),
+    "blender"    : (2, 78, 0),
+    "category"   : "Rigging",
+    "location"   : "3D View >> Tools",
+    "wiki_url"   : "",
+    "tracker_url": "",
+    "description": "Report which driven correctives the shot animation activates"
+}
+
+""" Finds the corrective shapekeys (created by driven_keys_exp.py) that the
+production's animation never activates.
+
+Every corrective's weight is computed for all frames of a set of actions with
+the same model as the drivers: the average of each driving channel divided by
+its max value. The channels are read from the actions' F-curves, so neither
+the rig nor the drivers have to be evaluated frame by frame. The report lists
+each corrective's peak weight and the fraction of frames it is active in.
+Correctives below the threshold can optionally be archived (shapekey and
+driver muted) or removed. For multi target correctives, the rig property's
+driver is archived or removed as well once no mesh reads it anymore.
+
+From the UI, the report is written as JSON to the 'corrective_coverage.json'
+text block. Actions can be linked from shot files without opening them (and are unlinked
+again after the pass), in background mode:
+
+    blender -b -y character.blend --python corrective_coverage.py -- \\
+        <mesh name> <report.json> [shot.blend ...] [--threshold 0.05] \\
+        [--prune archive|remove]
+
+When pruning from the command line, the character file is saved afterwards.
+"""
+
+import bpy, json, re, sys
+import numpy as np
+
+# Matches the "<channel>/<max value>" terms of a corrective's expression
+channel_pattern = re.compile( r'([A-Z]+_[XYZ])/(-?[\d.]+)' )
+
+def find_driver( anim_data, data_path ):
+    ''' Returns the driver F-curve of the data path, or None '''
+    for fc in anim_data.drivers:
+        if fc.data_path == data_path:
+            return fc
+    return None
+
+def corrective_models( obj ):
+    ''' Returns the channel/max model of every channel driven corrective on
+        the mesh, as a list of ( shapekey, bone, [ ( channel, max ), ... ] ).
+        Multi target correctives are followed to their rig property '''
+    key = obj.data.shape_keys
+    if not key or not key.animation_data:
+        return []
+
+    models = []
+    for fc in key.animation_data.drivers:
+        drv = fc.driver
+        if not drv.variables:
+            continue
+
+        shapekey = re.match( r'key_blocks\["(.+)"\]\.value', fc.data_path )
+        if not shapekey:
+            continue
+
+        # Multi target: the shapekey reads the rig's corrective property
+        target = drv.variables[0].targets[0]
+        if drv.variables[0].type == 'SINGLE_PROP' and target.id:
+            rig_drivers = target.id.animation_data
+            if not rig_drivers:
+                continue
+            rig_fc = find_driver( rig_drivers, target.data_path )
+            if not rig_fc:
+                continue
+            drv = rig_fc.driver
+
+        transforms = [ v for v in drv.variables if v.type == 'TRANSFORMS' ]
+        if not transforms or drv.type != 'SCRIPTED':
+            continue
+
+        channels = [
+            ( name, float( value ) )
+            for name, value in channel_pattern.findall( drv.expression )
+        ]
+        if channels:
+            bone = transforms[0].targets[0].bone_target
+            models.append( ( shapekey.group( 1 ), bone, channels ) )
+
+    return models
+
+def channel_values( action, bone, frames ):
+    ''' Evaluates the bone's local location, euler rotation and scale over
+        all frames, and returns them by transform channel name '''
+    base   = 'pose.bones["' + bone + '"].'
+    curves = {
+        ( fc.data_path, fc.array_index ) : fc
+        for fc in action.fcurves if fc.data_path.startswith( base )
+    }
+
+    def evaluate( prop, index, rest ):
+        fc = curves.get( ( base + prop, index ) )
+        if fc is None:
+            return np.full( len( frames ), rest )
+        return np.array( [ fc.evaluate( f ) for f in frames ] )
+
+    values = {}
+    for i, axis in enumerate( [ 'X', 'Y', 'Z' ] ):
+        values[ 'LOC_'   + axis ] = evaluate( 'location', i, 0.0 )
+        values[ 'SCALE_' + axis ] = evaluate( 'scale',    i, 1.0 )
+
+    quat = [ ( base + 'rotation_quaternion', i ) in curves for i in range( 4 ) ]
+    if any( quat ):
+        # Quaternion to XYZ euler, for all frames at once
+        w, x, y, z = [ evaluate( 'rotation_quaternion', i, float( i == 0 ) ) for i in range( 4 ) ]
+
+        values['ROT_X'] = np.arctan2( 2 * ( w * x + y * z ), 1 - 2 * ( x * x + y * y ) )
+        values['ROT_Y'] = np.arcsin( np.clip( 2 * ( w * y - z * x ), -1.0, 1.0 ) )
+        values['ROT_Z'] = np.arctan2( 2 * ( w * z + x * y ), 1 - 2 * ( y * y + z * z ) )
+    else:
+        for i, axis in enumerate( [ 'X', 'Y', 'Z' ] ):
+            values[ 'ROT_' + axis ] = evaluate( 'rotation_euler', i, 0.0 )
+
+    return values
+
+def corrective_coverage( obj, actions, threshold = 0.05 ):
+    ''' Computes the peak weight and activation frequency (fraction of frames
+        with a weight above the threshold) of all the mesh's correctives '''
+    models = corrective_models( obj )
+
+    peaks  = np.zeros( len( models ) )
+    active = np.zeros( len( models ) )
+    total  = 0
+
+    prefixes = tuple( set( 'pose.bones["' + bone + '"]' for s, bone, c in models ) )
+
+    for action in actions:
+        # Actions that don't animate the driving bones don't count as shots
+        if not any( fc.data_path.startswith( prefixes ) for fc in action.fcurves ):
+            continue
+
+        start, end = action.frame_range
+        frames     = np.arange( int( start ), int( end ) + 1 )
+        total     += len( frames )
+
+        bones = {}
+        for shapekey, bone, channels in models:
+            if bone not in bones:
+                bones[ bone ] = channel_values( action, bone, frames )
+
+        # ( correctives, frames ) matrix of weights
+        weights = np.array( [
+            np.mean( [ bones[ bone ][ ch ] / mx for ch, mx in channels if mx ], axis = 0 )
+            for shapekey, bone, channels in models
+        ] ).reshape( len( models ), len( frames ) )
+
+        peaks   = np.maximum( peaks, weights.max( axis = 1 ) )
+        active += ( weights > threshold ).sum( axis = 1 )
+
+    return {
+        shapekey : {
+            'peak'      : float( peaks[ i ] ),
+            'frequency' : float( active[ i ] / total ) if total else 0.0
+        }
+        for i, ( shapekey, bone, channels ) in enumerate( models )
+    }
+
+def prop_readers( rig, data_path, muted = False ):
+    ''' Returns the shapekey drivers, on all meshes, that read the rig
+        property (multi target correctives). Muted drivers are only
+        included on request '''
+    readers = []
+    for key in bpy.data.shape_keys:
+        if not key.animation_data:
+            continue
+        for fc in key.animation_data.drivers:
+            if fc.mute and not muted:
+                continue
+            for var in fc.driver.variables:
+                target = var.targets[0]
+                if var.type == 'SINGLE_PROP' and target.id == rig and \
+                   target.data_path == data_path:
+                    readers.append( fc )
+    return readers
+
+def prune_correctives( obj, report, threshold = 0.05, mode = 'ARCHIVE' ):
+    ''' Archives (mutes) or removes the correctives whose peak weight stays
+        below the threshold, and returns their names. The rig property
+        driver of a multi target corrective is muted or removed too, once
+        no mesh reads the property anymore '''
+    key    = obj.data.shape_keys
+    unused = [ name for name, c in report.items() if c['peak'] < threshold ]
+
+    for name in unused:
+        kb   = key.key_blocks[ name ]
+        path = kb.path_from_id( 'value' )
+        fc   = find_driver( key.animation_data, path ) if key.animation_data else None
+
+        # Multi target: the shapekey only reads the rig's corrective property
+        rig, prop_path = None, None
+        if fc and len( fc.driver.variables ) == 1:
+            var = fc.driver.variables[0]
+            if var.type == 'SINGLE_PROP' and var.targets[0].id:
+                rig       = var.targets[0].id
+                prop_path = var.targets[0].data_path
+
+        if mode == 'REMOVE':
+            key.driver_remove( path )
+            obj.shape_key_remove( kb )
+        else:
+            if fc:
+                fc.mute = True
+            kb.mute = True
+
+        # Removing the property breaks archived readers, muting it doesn't
+        if rig is None or prop_readers( rig, prop_path, mode == 'REMOVE' ):
+            continue
+
+        rig_fc = find_driver( rig.animation_data, prop_path ) if rig.animation_data else None
+        if mode == 'REMOVE':
+            if rig_fc:
+                rig.driver_remove( prop_path )
+            prop = re.match( r'\["(.+)"\]$', prop_path )
+            if prop and prop.group( 1 ) in rig.keys():
+                del rig[ prop.group( 1 ) ]
+        elif rig_fc:
+            rig_fc.mute = True
+
+    return unused
+
+def shot_actions( filepaths ):
+    ''' Links the actions of the shot files, without opening the files.
+        Call unlink_shot_actions() on the result once they are evaluated '''
+    actions = []
+    for path in filepaths:
+        with bpy.data.libraries.load( path, link = True ) as ( data_from, data_to ):
+            data_to.actions = data_from.actions
+        actions.extend( a for a in data_to.actions if a )
+    return actions
+
+def unlink_shot_actions( actions, keep = () ):
+    ''' Removes the libraries the shot actions were linked from, so that
+        they don't end up referenced by the saved file. Libraries in keep
+        (the ones linked before the shots were loaded) are left alone '''
+    libraries = set( a.library for a in actions if a.library )
+    for lib in libraries:
+        if lib not in keep:
+            bpy.data.libraries.remove( lib )
+
+def write_report( report, name = 'corrective_coverage.json' ):
+    ''' Writes the report as JSON into a text block, and returns it '''
+    text = bpy.data.texts.get( name ) or bpy.data.texts.new( name )
+
+    text.clear()
+    text.write( json.dumps( report, indent = 4, sort_keys = True ) )
+
+    return text
+
+
+class CorrectiveCoveragePanel(bpy.types.Panel):
+    bl_idname      = "CorrectiveCoveragePanel"
+    bl_label       = "Corrective Coverage"
+    bl_space_type  = 'VIEW_3D'
+    bl_region_type = 'TOOLS'
+    bl_context     = 'objectmode'
+
+    @classmethod
+    def poll( self, context ):
+        obj = context.active_object
+        return obj is not None and obj.type == 'MESH' and obj.data.shape_keys
+
+    def draw( self, context ):
+        layout = self.layout
+
+        col = layout.column()
+
+        col.operator( 'object.corrective_coverage' )
+
+
+class CorrectiveCoverage( bpy.types.Operator ):
+    """ Report how much the file's actions activate the mesh's correctives """
+    bl_idname      = "object.corrective_coverage"
+    bl_label       = "Corrective coverage"
+    bl_description = "Report how much the file's actions activate the active mesh's correctives"
+    bl_options     = { 'REGISTER', 'UNDO' }
+
+    threshold = bpy.props.FloatProperty(
+        name        = "Threshold",
+        description = "weight above which a corrective counts as active",
+        default     = 0.05,
+        min         = 0.0,
+        max         = 1.0
+    )
+
+    prune_items = [
+        ('NONE',    'None',    'Only report'),
+        ('ARCHIVE', 'Archive', 'Mute unused correctives and their drivers'),
+        ('REMOVE',  'Remove',  'Delete unused correctives and their drivers')
+    ]
+    prune = bpy.props.EnumProperty(
+        name    = "Prune",
+        items   = prune_items,
+        default = 'NONE'
+    )
+
+    @classmethod
+    def poll( self, context ):
+        obj = context.active_object
+        return obj is not None and obj.type == 'MESH' and obj.data.shape_keys
+
+    def invoke( self, context, event ):
+        return context.window_manager.invoke_props_dialog( self )
+
+    def execute( self, context ):
+        obj    = context.active_object
+        report = corrective_coverage( obj, bpy.data.actions, self.threshold )
+
+        text = write_report( report )
+
+        if self.prune != 'NONE':
+            unused = prune_correctives( obj, report, self.threshold, self.prune )
+            self.report( {'INFO'}, "Pruned %d correctives, report in %s" % (
+                len( unused ), text.name
+            ) )
+        else:
+            unused = [ n for n, c in report.items() if c['peak'] < self.threshold ]
+            self.report( {'INFO'}, "%d of %d correctives never fire, report in %s" % (
+                len( unused ), len( report ), text.name
+            ) )
+
+        return {'FINISHED'}
+
+
+def register():
+    bpy.utils.register_module(__name__)
+
+def unregister():
+    bpy.utils.unregister_module(__name__)
+
+if __name__ == "__main__":
+    # Background mode: arguments come after '--' on blender's command line
+    args = sys.argv[ sys.argv.index( '--' ) + 1: ] if '--' in sys.argv else []
+
+    threshold, prune = 0.05, 'NONE'
+    if '--threshold' in args:
+        i         = args.index( '--threshold' )
+        threshold = float( args[ i + 1 ] )
+        del args[ i: i + 2 ]
+    if '--prune' in args:
+        i     = args.index( '--prune' )
+        prune = args[ i + 1 ].upper()
+        del args[ i: i + 2 ]
+
+    if len( args ) >= 2:
+        obj = bpy.data.objects[ args[0] ]
+
+        if args[2:]:
+            libraries = set( bpy.data.libraries )
+            actions   = shot_actions( args[2:] )
+            try:
+                report = corrective_coverage( obj, actions, threshold )
+            finally:
+                unlink_shot_actions( actions, libraries )
+        else:
+            report = corrective_coverage( obj, bpy.data.actions, threshold )
+
+        with open( args[1], 'w' ) as f:
+            json.dump( report, f, indent = 4, sort_keys = True )
+
+        if prune != 'NONE':
+            prune_correctives( obj, report, threshold, prune )
+            bpy.ops.wm.save_mainfile()
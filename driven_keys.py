@@ -55,6 +55,19 @@ an empty shapekey will be created and the driver will be added to it.
 
 import bpy
 
+def rest_matrix( pb ):
+    ''' Returns the pose bone's matrix as a flat, 16 item list, to be
+        recorded as the rest position of a delta transforms driver '''
+    matrix = []
+    
+    # A transformation matrix is composed of 4 vectors of 4 points each
+    # These are stored as a simple array here
+    for v in pb.matrix:
+        for p in v:
+            matrix.append( p )
+
+    return matrix
+
 class DrivenKeysPanel(bpy.types.Panel):
     bl_idname      = "DrivenKeysPanel"
     bl_label       = "Driven Shapekeys"
@@ -87,23 +100,27 @@ class UpdateKeyPanel(bpy.types.Panel):
     bl_region_type = 'TOOLS'
     bl_context     = 'posemode'
 
-    drv_sk_props = context.scene.corrective_drivenkeys_props
-
     @classmethod
     def poll( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
         # If 'update_key' = True, and a mesh object was selected, 
         # then this panel should appear
         return drv_sk_props.update_key and drv_sk_props.mesh_object
 
     def draw( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
         layout = self.layout
 
         obj = bpy.context.scene.objects[ drv_sk_props.mesh_object ]
         sk  = obj.data.shape_keys
 
+        col = layout.column()
+
         col.prop_search(          
             drv_sk_props, "update_shapekey", # Pick shapekey out of the list of
-            sk,           key_blocks         # shapkeys on the selected object
+            sk,           "key_blocks"       # shapkeys on the selected object
         )
 
 
@@ -114,10 +131,9 @@ class b2bDriverPanel(bpy.types.Panel):
     bl_region_type = 'TOOLS'
     bl_context     = 'posemode'
 
-    drv_sk_props = context.scene.corrective_drivenkeys_props
-
     @classmethod
     def poll( self, context ):
+        drv_sk_props   = context.scene.corrective_drivenkeys_props
         selected_bones = [ bone.name for bone in context.object.data.bones if bone.select ]
         
         correct_type        = drv_sk_props.driver_type == 'b2b distance'
@@ -140,10 +156,9 @@ class dTransDriverPanel(bpy.types.Panel):
     bl_region_type = 'TOOLS'
     bl_context     = 'posemode'
 
-    drv_sk_props = context.scene.corrective_drivenkeys_props
-
     @classmethod
     def poll( self, context ):
+        drv_sk_props   = context.scene.corrective_drivenkeys_props
         selected_bones = [ b.name for b in context.object.data.bones if b.select ]
         
         correct_type        = drv_sk_props.driver_type == '1b delta transforms'
@@ -184,22 +199,15 @@ class record_rest_pos( bpy.types.Operator ):
         return False
 
     def execute( self, context):
+        obj = context.object
+
         # Get the selected bone
         name = [ b.name for b in obj.data.bones if b.select ].pop()
-        pb   = obj.pose.bones[ name ]
 
-        matrix = []
-        
-        # A transformation matrix is composed of 4 vectors of 4 points each
-        # These are stored as a simple array here
-        for v in pb.matrix:
-            for p in v:
-                matrix.append( p )
-                
         drv_sk_props = context.scene.corrective_drivenkeys_props
         
         # Update external property
-        drv_sk_props.rest_pos = matrix
+        drv_sk_props.rest_pos = rest_matrix( obj.pose.bones[ name ] )
         
         return {'FINISHED'}
 
@@ -211,11 +219,10 @@ class b2bDriver( bpy.types.Operator ):
     bl_description = "Create a B2B distance based shapekey driver"
     bl_options     = { 'REGISTER', 'UNDO' }
 
-    drv_sk_props = context.scene.corrective_drivenkeys_props
-    sk_obj       = context.scene.objects[ drv_sk_props.mesh_object ]
-
     @classmethod
     def poll( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+        sk_obj       = context.scene.objects.get( drv_sk_props.mesh_object )
 
         if drv_sk_props.update_key and not drv_sk_props.update_shakepey:
             # If the "update key" options was selected but no specific 
@@ -230,7 +237,7 @@ class b2bDriver( bpy.types.Operator ):
                 # and if there's exactly 2 pose bones selected
                 if len( [ b for b in obj.data.bones if b.select ] ) == 2:
                     # Make sure the user selected a proper obj for shapekeying
-                    if drv_sk_props.mesh_object and sk_obj.type = 'MESH':
+                    if sk_obj and sk_obj.type == 'MESH':
                         # then enable this operator
                         return True
         return False
@@ -34,7 +34,7 @@ bl_info = {
     "name"       : "Driven Shapekeys",
     "authors"    : [ "Tamir Lousky", "Kfir Merlaub" ],
     "version"    : (0, 0, 1),
-    "blender"    : (2, 66, 0),
+    "blender"    : (2, 70, 0),
     "category"   : "Rigging",
     "location"   : "3D View >> Tools",
     "wiki_url"   : "https://github.com/pitchipoy/rigging_utils/wiki/driven-corrective-shapekeys-(driven_keys_exp.py)",
@@ -56,14 +56,61 @@ shapekey that should be fully activated when the elbow bone is rotated to
 130 degrees (i.e. the max value = 130).
 
 If you select more than one transformation channel, the shapekey's value will
-be driven by an average of all channels.
+be driven by an average of all channels. Channel setups you use often can be
+saved as presets and loaded back in one go.
+
+Creating the driver again for a shapekey that already has one updates it in
+place: only the channels, max values or response that changed are edited, and
+re-running it with the same settings leaves the driver untouched.
+
+The response option shapes the shapekey's value (ease in/out, clamping or a
+custom f(x) of numbers, math constants, arithmetic, math functions, min, max
+and abs). The shape is baked into keyframes on the driver's F-curve, so the
+driver's expression stays linear and playback doesn't pay for the shaping
+with python evaluation.
 
 If the bone you selected represents one side of a symmetrical rig, you can
 use the symmetrize option to create another shapekey and driver for the
 opposite side's bone (this assumes standard bone naming, exm: 'hand.L.001').
+A new (or still empty) opposite shapekey is filled with the X mirrored shape
+of the original one; an opposite shapekey that was already sculpted is kept.
+
+Instead of sculpting a corrective in rest space, you can pose the rig at the
+channels' max values, sculpt the fix on a copy of the posed mesh, and extract
+the rest space corrective from it. The armature deformation is inverted per
+vertex (linear blend skinning), and the driver is then created as usual.
+
+For faster playback, each mesh's correctives can be rated by their impact
+(largest vertex offset) into tiers. With simplify on, the shapekeys and drivers
+of all correctives below the chosen tier are muted; renders, exports and
+saved files restore them.
+
+With the multi target option, the corrective's weight is computed once into a
+'corrective_<shapekey>' property on the rig, and the shapekey only reads that
+property. Matching shapekeys on other meshes (clothing, LODs) can then be
+linked to the same property in bulk, without duplicating the driver math.
+
+The "pose space" driver type is meant for correctives that depend on several
+sample poses (shoulders, hips). Each sample pairs a pose from the rig's pose
+library with the shapekey that should be fully active in that pose. The RBF
+weights of all the mesh's pose space correctives are solved once when the
+drivers are created (edited samples take effect when the drivers are created
+again), and at runtime all correctives of the mesh are evaluated together
+with a single matrix-vector product (requires auto-run scripts, since the
+drivers call the 'pose_space' driver namespace function).
+
+Pipeline scripts can skip the UI and call add_corrective_drivers( mesh, rig,
+specs ) to set up many correctives at once (unlike the panel, rotation max
+values are given in radians). Inside batch_updates(), the
+meshes they change are updated once, followed by a single scene update and
+redraw, when the block ends.
 """
 
-import bpy, math, re
+import bpy, ast, hashlib, math, re
+import numpy as np
+from mathutils import Quaternion, kdtree
+from bpy.app.handlers import persistent
+from contextlib import contextmanager
 
 class DrivenKeysPanel(bpy.types.Panel):
     bl_idname      = "DrivenKeysPanel"
@@ -80,6 +127,8 @@ class DrivenKeysPanel(bpy.types.Panel):
 
         col = layout.column()
 
+        col.prop( drv_sk_props, 'driver_type' ) # Choose driver type
+
         col.prop_search(          
             drv_sk_props, "mesh_object", # Pick object out of
             context.scene, "objects"     # the list of objects in the scene
@@ -132,7 +181,10 @@ class DriverPanel(bpy.types.Panel):
     def poll( self, context ):
         drv_sk_props   = context.scene.corrective_drivenkeys_props
         selected_bones = [ bone.name for bone in context.object.data.bones if bone.select ]
-        
+
+        if drv_sk_props.driver_type != 'CHANNELS':
+            return False
+
         name = drv_sk_props.mesh_object
         
         obj_exists = name in [ obj.name for obj in context.scene.objects ]
@@ -152,26 +204,901 @@ class DriverPanel(bpy.types.Panel):
         layout = self.layout
         
         col = layout.column()
+
+        col.prop_search(
+            drv_sk_props, "preset_name",    # Pick a channel preset out of
+            drv_sk_props, "channel_presets" # the saved presets
+        )
+        row = col.row( align = True )
+        row.operator( 'armature.save_channel_preset' )
+        row.operator( 'armature.load_channel_preset' )
+
+        col.separator()
         
-        for trans_channel in [ 'loc', 'rot', 'scl' ]:
-            for axis in [ 'X', 'Y', 'Z' ]:
-                label = trans_channel + " " + axis
-                prop1 = trans_channel + axis
-                prop2 = prop1 + 'max'
+        for i, label in enumerate( channel_labels ):
+            row = col.row()
 
-                row = col.row()
+            row.label( text = label )
 
-                row.label( text = label )
+            row.prop( drv_sk_props, 'channels',    index = i, text = "" )
+            row.prop( drv_sk_props, 'channel_max', index = i, text = "max" )
 
-                row.prop( drv_sk_props, prop1 )
-                row.prop( drv_sk_props, prop2 )
+        for name in channel_spec( drv_sk_props )['invalid']:
+            col.label( text = name + " needs a max value", icon = 'ERROR' )
         
         col.separator()
+
+        col.prop( drv_sk_props, 'response' )
+        if drv_sk_props.response == 'CUSTOM':
+            col.prop( drv_sk_props, 'response_expression' )
         
         col.prop( drv_sk_props, 'symmetrize' )
+        col.prop( drv_sk_props, 'multi_target' )
         
         col.operator( 'armature.create_driver' )
 
+        col.separator()
+
+        col.prop_search(
+            drv_sk_props,  "sculpt_object", # Pick the posed sculpt out of
+            context.scene, "objects"        # the list of objects in the scene
+        )
+        col.operator( 'armature.extract_corrective' )
+
+        if drv_sk_props.multi_target:
+            col.operator( 'armature.link_correctives' )
+
+
+# Prefix of the rig properties holding multi target corrective weights
+corrective_prefix = 'corrective_'
+
+def corrective_prop( shapekey_name ):
+    ''' Returns the name of the rig property holding a corrective's weight '''
+    return corrective_prefix + shapekey_name
+
+def link_corrective( obj, rig, shapekey_name ):
+    ''' Drives a mesh's shapekey by the matching corrective property on the
+        rig. The driver is a plain average of a single property, so it is
+        evaluated natively without any python expression '''
+    key       = obj.data.shape_keys
+    shapekey  = key.key_blocks[ shapekey_name ]
+    data_path = '["' + corrective_prop( shapekey_name ) + '"]'
+
+    # Nothing to do if the shapekey is already linked
+    fc = None
+    if key.animation_data:
+        fc = find_driver( key.animation_data, shapekey.path_from_id( 'value' ) )
+    if fc and fc.driver.type == 'AVERAGE' and len( fc.driver.variables ) == 1:
+        var = fc.driver.variables[0]
+        if var.type == 'SINGLE_PROP' and var.targets[0].id == rig:
+            if var.targets[0].data_path == data_path:
+                return
+
+    # Replace any previous driver instead of stacking variables on it
+    shapekey.driver_remove( "value" )
+
+    drv      = shapekey.driver_add( "value" ).driver
+    drv.type = 'AVERAGE'
+
+    drv_var                      = drv.variables.new()
+    drv_var.name                 = 'weight'
+    drv_var.type                 = 'SINGLE_PROP'
+    drv_var.targets[0].id        = rig
+    drv_var.targets[0].data_path = data_path
+
+    update_driver_index( obj, shapekey_name )
+
+
+# Reverse index of the correctives' drivers, keyed by mesh object name. Each
+# index maps ( rig name, bone name ) to the shapekeys the bone drives, as
+# { shapekey : [ ( channel, max value ), ... ] }.
+driver_index = {}
+
+# Matches the "<variable>/<max value>" terms of a channel driver's expression
+expression_channels = re.compile( r'(\w+)/(-?[\d.]+)' )
+
+# Matches the data path of a shapekey's value
+shapekey_path = re.compile( r'key_blocks\["(.+)"\]\.value' )
+
+def find_driver( anim_data, data_path ):
+    ''' Returns the driver F-curve of the data path, or None '''
+    for fc in anim_data.drivers:
+        if fc.data_path == data_path:
+            return fc
+    return None
+
+def resolve_driver( drv ):
+    ''' Follows a multi target link to the driver of the rig's property '''
+    if len( drv.variables ) == 1 and drv.variables[0].type == 'SINGLE_PROP':
+        target = drv.variables[0].targets[0]
+        if target.id and target.id.animation_data:
+            fc = find_driver( target.id.animation_data, target.data_path )
+            if fc:
+                return fc.driver
+    return drv
+
+def index_driver( index, shapekey_name, drv ):
+    ''' Adds a shapekey's driver to the index, under each bone it reads '''
+    drv   = resolve_driver( drv )
+    maxes = dict( expression_channels.findall( drv.expression ) )
+
+    for var in drv.variables:
+        if var.type != 'TRANSFORMS':
+            continue
+
+        target = var.targets[0]
+        if not target.id or not target.bone_target:
+            continue
+
+        # Pose space drivers have no max values
+        mx = float( maxes[ var.name ] ) if var.name in maxes else None
+
+        bone = index.setdefault( ( target.id.name, target.bone_target ), {} )
+        bone.setdefault( shapekey_name, [] ).append( ( target.transform_type, mx ) )
+
+def get_driver_index( obj ):
+    ''' Returns the mesh's driver index, building it on first use from all of
+        the mesh's shapekey drivers '''
+    index = driver_index.get( obj.name )
+    if index is not None:
+        return index
+
+    index = {}
+    key   = obj.data.shape_keys
+    if key and key.animation_data:
+        for fc in key.animation_data.drivers:
+            name = shapekey_path.match( fc.data_path )
+            if name:
+                index_driver( index, name.group( 1 ), fc.driver )
+
+    driver_index[ obj.name ] = index
+
+    return index
+
+def update_driver_index( obj, shapekey_name ):
+    ''' Re-indexes a single shapekey's driver after it was (re)created '''
+    index = driver_index.get( obj.name )
+    if index is None:
+        # Not built yet, it will be read whole on first use
+        return
+
+    for shapekeys in index.values():
+        shapekeys.pop( shapekey_name, None )
+
+    key = obj.data.shape_keys
+    if key and key.animation_data:
+        fc = find_driver( key.animation_data, 'key_blocks["' + shapekey_name + '"].value' )
+        if fc:
+            index_driver( index, shapekey_name, fc.driver )
+
+@persistent
+def driver_index_load( dummy ):
+    ''' Drops the indices of the previous file '''
+    driver_index.clear()
+
+
+class BoneDriversPanel(bpy.types.Panel):
+    bl_idname      = "BoneDriversPanel"
+    bl_label       = "Correctives driven by bone"
+    bl_space_type  = 'VIEW_3D'
+    bl_region_type = 'TOOLS'
+    bl_context     = 'posemode'
+
+    @classmethod
+    def poll( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+        obj          = context.scene.objects.get( drv_sk_props.mesh_object )
+
+        return context.active_pose_bone and obj and obj.type == 'MESH'
+
+    def draw( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        layout = self.layout
+
+        obj = context.scene.objects[ drv_sk_props.mesh_object ]
+        rig = context.object
+        pb  = context.active_pose_bone
+
+        col = layout.column()
+
+        shapekeys = get_driver_index( obj ).get( ( rig.name, pb.name ), {} )
+
+        if not shapekeys:
+            col.label( text = "No correctives driven by " + pb.name )
+
+        for name in sorted( shapekeys ):
+            box = col.box()
+            box.label( text = name, icon = 'SHAPEKEY_DATA' )
+            for channel, mx in shapekeys[ name ]:
+                if mx is None:
+                    box.label( text = channel )
+                else:
+                    box.label( text = channel + " / " + str( round( mx, 3 ) ) )
+
+        col.operator( 'object.rebuild_driver_index' )
+
+
+class RebuildDriverIndex( bpy.types.Operator ):
+    """ Re-read all drivers of the chosen mesh into the bone index """
+    bl_idname      = "object.rebuild_driver_index"
+    bl_label       = "Rebuild driver index"
+    bl_description = "Re-read all drivers of the chosen mesh"
+    bl_options     = { 'REGISTER' }
+
+    def execute( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        driver_index.pop( drv_sk_props.mesh_object, None )
+
+        return {'FINISHED'}
+
+
+# Vertex mirror maps, keyed by mesh data pointer. Each entry stores the
+# signature (topology and coordinates) it was built for, and is rebuilt only
+# when that signature changes.
+mirror_map_cache = {}
+
+# Maximal distance between a vertex's mirrored position and its counterpart
+mirror_tolerance = 0.001
+
+def mesh_topology( mesh ):
+    ''' Returns a cheap signature of the mesh's topology '''
+    return ( len( mesh.vertices ), len( mesh.edges ), len( mesh.polygons ) )
+
+def mirror_map( mesh ):
+    ''' Returns an array mapping each vertex to its X mirrored counterpart
+        (-1 where there is none). The map is built once with a KD-tree and
+        cached until the mesh topology or its vertex coordinates change '''
+    count = len( mesh.vertices )
+    co    = np.empty( count * 3, dtype = np.float32 )
+    mesh.vertices.foreach_get( 'co', co )
+
+    # Edits that keep the counts (like moving basis vertices) change the hash
+    signature = mesh_topology( mesh ) + ( hash( co.tobytes() ), )
+
+    cached = mirror_map_cache.get( mesh.as_pointer() )
+    if cached and cached[0] == signature:
+        return cached[1]
+
+    co = co.reshape( count, 3 )
+
+    tree = kdtree.KDTree( count )
+    for i, v in enumerate( co ):
+        tree.insert( v, i )
+    tree.balance()
+
+    mapping = np.full( count, -1, dtype = np.int32 )
+    for i, ( x, y, z ) in enumerate( co ):
+        found, j, dist = tree.find( ( -x, y, z ) )
+        if dist <= mirror_tolerance:
+            mapping[ i ] = j
+
+    mirror_map_cache[ mesh.as_pointer() ] = ( signature, mapping )
+
+    return mapping
+
+def shapekey_is_empty( obj, name ):
+    ''' Returns True if the mesh has no such shapekey, or if the shapekey
+        doesn't move any vertex away from its reference key '''
+    key = obj.data.shape_keys
+    if not key or name not in key.key_blocks:
+        return True
+
+    kb    = key.key_blocks[ name ]
+    count = len( obj.data.vertices )
+
+    co    = np.empty( count * 3, dtype = np.float32 )
+    basis = np.empty( count * 3, dtype = np.float32 )
+    kb.data.foreach_get( 'co', co )
+    kb.relative_key.data.foreach_get( 'co', basis )
+
+    return np.array_equal( co, basis )
+
+def mirror_shapekey( obj, source_name, target_name ):
+    ''' Writes the X mirrored deltas of the source shapekey into the target
+        shapekey. Coordinates are read and written in bulk '''
+    key_blocks = obj.data.shape_keys.key_blocks
+    source     = key_blocks[ source_name ]
+    target     = key_blocks[ target_name ]
+    basis      = source.relative_key
+
+    count   = len( obj.data.vertices )
+    mapping = mirror_map( obj.data )
+
+    source_co = np.empty( count * 3, dtype = np.float32 )
+    basis_co  = np.empty( count * 3, dtype = np.float32 )
+    source.data.foreach_get( 'co', source_co )
+    basis.data.foreach_get(  'co', basis_co  )
+
+    delta = ( source_co - basis_co ).reshape( count, 3 )
+
+    # Each vertex takes its counterpart's delta, flipped along X
+    mirrored = delta[ mapping ]
+    mirrored[ :, 0 ] *= -1
+    mirrored[ mapping < 0 ] = 0.0
+
+    target.data.foreach_set( 'co', basis_co + mirrored.ravel() )
+    request_update( obj.data )
+
+
+def skinning_matrices( obj, rig ):
+    ''' Returns a (vertices, 3, 3) array with the linear part of each
+        vertex's armature deformation, in the rig's space. Blends the bones'
+        deform matrices by the normalized vertex group weights, like the
+        armature modifier's linear (non volume preserving) skinning '''
+    bones = rig.data.bones
+    count = len( obj.data.vertices )
+
+    # Deform matrix of every vertex group that represents a deforming bone
+    group_bones = {}
+    for vg in obj.vertex_groups:
+        if vg.name in bones and bones[ vg.name ].use_deform:
+            pb = rig.pose.bones[ vg.name ]
+            group_bones[ vg.index ] = pb.matrix * pb.bone.matrix_local.inverted()
+
+    group_index = { g : i for i, g in enumerate( group_bones ) }
+    deform      = np.array(
+        [ np.array( m )[ :3, :3 ] for m in group_bones.values() ]
+    ).reshape( -1, 3, 3 )
+
+    # Vertex group weights can only be read per vertex, flatten them into
+    # (vertex, bone, weight) triplets for the batched blend
+    vert_idx, bone_idx, weights = [], [], []
+    for v in obj.data.vertices:
+        for g in v.groups:
+            if g.group in group_index and g.weight > 0.0:
+                vert_idx.append( v.index )
+                bone_idx.append( group_index[ g.group ] )
+                weights.append(  g.weight )
+
+    vert_idx = np.array( vert_idx, dtype = np.int32 )
+    bone_idx = np.array( bone_idx, dtype = np.int32 )
+    weights  = np.array( weights,  dtype = np.float64 )
+
+    total = np.zeros( count )
+    np.add.at( total, vert_idx, weights )
+
+    blended = np.zeros( ( count, 3, 3 ) )
+    np.add.at( blended, vert_idx, weights[ :, None, None ] * deform[ bone_idx ] )
+
+    # Unweighted vertices aren't deformed, the others are normalized
+    skinned = total > 0.0
+    blended[ skinned ] /= total[ skinned, None, None ]
+    blended[ ~skinned ] = np.eye( 3 )
+
+    return blended
+
+def extract_corrective( context, obj, rig, sculpt, shapekey_name ):
+    ''' Computes the rest space corrective that turns the current, posed
+        mesh into the posed sculpt, and writes it into the shapekey '''
+    scene      = context.scene
+    key_blocks = obj.data.shape_keys.key_blocks
+    shapekey   = key_blocks[ shapekey_name ]
+    count      = len( obj.data.vertices )
+
+    if len( sculpt.data.vertices ) != count:
+        raise RuntimeError( "The sculpt doesn't match the mesh's vertex count" )
+
+    # Current deformed mesh, without the corrective we are extracting
+    muted         = shapekey.mute
+    shapekey.mute = True
+    try:
+        deformed = obj.to_mesh( scene, True, 'PREVIEW' )
+    finally:
+        shapekey.mute = muted
+
+    if len( deformed.vertices ) != count:
+        bpy.data.meshes.remove( deformed )
+        raise RuntimeError( "The mesh's modifiers change its vertex count" )
+
+    current = np.empty( count * 3 )
+    target  = np.empty( count * 3 )
+    deformed.vertices.foreach_get( 'co', current )
+    sculpt.data.vertices.foreach_get( 'co', target )
+    bpy.data.meshes.remove( deformed )
+
+    # Bring the sculpt into the mesh's space, then both into the rig's space
+    to_mesh = np.array( obj.matrix_world.inverted() * sculpt.matrix_world )
+    target  = target.reshape( count, 3 ).dot( to_mesh[ :3, :3 ].T ) + to_mesh[ :3, 3 ]
+
+    to_rig = np.array( rig.matrix_world.inverted() * obj.matrix_world )[ :3, :3 ]
+    posed  = ( target - current.reshape( count, 3 ) ).dot( to_rig.T )
+
+    # Undo the skinning of the posed difference, for all vertices at once
+    try:
+        rest = np.linalg.solve( skinning_matrices( obj, rig ), posed[ :, :, None ] )
+    except np.linalg.LinAlgError:
+        raise RuntimeError(
+            "Some vertices can't be unskinned, check for bones scaled to 0"
+        )
+    delta = rest[ :, :, 0 ].dot( np.linalg.inv( to_rig ).T )
+
+    basis_co = np.empty( count * 3 )
+    shapekey.relative_key.data.foreach_get( 'co', basis_co )
+    shapekey.data.foreach_set( 'co', basis_co + delta.ravel() )
+    request_update( obj.data )
+
+
+# Response curves mapping the linear driver value (0 at rest, 1 at the max
+# values) to the shapekey's value. 'CUSTOM' uses an expression of x.
+response_curves = {
+    'CLAMP'      : lambda x: x,
+    'SMOOTHSTEP' : lambda x: x * x * ( 3 - 2 * x ),
+    'EASE_IN'    : lambda x: x * x,
+    'EASE_OUT'   : lambda x: 1 - ( 1 - x ) ** 2
+}
+
+# Number of keyframes a response curve is sampled into
+response_samples = 9
+
+# Functions and constants a custom response expression may use, and its
+# operators
+response_functions = {
+    k : v for k, v in math.__dict__.items()
+    if not k.startswith( '_' ) and callable( v )
+}
+response_functions.update( { 'min' : min, 'max' : max, 'abs' : abs } )
+
+response_constants = {
+    k : v for k, v in math.__dict__.items() if isinstance( v, float )
+}
+response_operators = (
+    ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod, ast.Pow,
+    ast.UAdd, ast.USub
+)
+
+# Number literals are ast.Num up to python 3.7, and ast.Constant after
+response_numbers = tuple(
+    getattr( ast, n ) for n in ( 'Num', 'Constant' ) if hasattr( ast, n )
+)
+
+def check_response_node( node ):
+    ''' Raises ValueError unless the expression node is made only of numbers,
+        x, math constants, arithmetic operators and calls to math functions
+        (or min, max and abs) '''
+    if isinstance( node, ast.Expression ):
+        return check_response_node( node.body )
+
+    if isinstance( node, ast.BinOp ) and isinstance( node.op, response_operators ):
+        check_response_node( node.left )
+        return check_response_node( node.right )
+
+    if isinstance( node, ast.UnaryOp ) and isinstance( node.op, response_operators ):
+        return check_response_node( node.operand )
+
+    if isinstance( node, ast.Call ) and isinstance( node.func, ast.Name ):
+        if node.func.id in response_functions and not node.keywords:
+            for arg in node.args:
+                check_response_node( arg )
+            return
+
+    if isinstance( node, ast.Name ):
+        if node.id == 'x' or node.id in response_constants:
+            return
+
+    if isinstance( node, response_numbers ):
+        value = node.value if hasattr( node, 'value' ) else node.n
+        if isinstance( value, ( int, float ) ) and not isinstance( value, bool ):
+            return
+
+    raise ValueError( "Unsupported term in response expression" )
+
+def response_points( response, expression = 'x' ):
+    ''' Samples the response curve into ( x, y, interpolation ) keyframes.
+        An empty list stands for the linear response. Raises ValueError if
+        a custom expression is invalid or can't be evaluated on [0, 1] '''
+    points = []
+
+    if response == 'LINEAR':
+        return points
+
+    if response == 'CUSTOM':
+        try:
+            tree = ast.parse( expression, mode = 'eval' )
+        except SyntaxError:
+            raise ValueError( "Invalid response expression: " + expression )
+
+        check_response_node( tree )
+
+        code  = compile( tree, '<response>', 'eval' )
+        curve = lambda x: eval(
+            code, { '__builtins__' : {} },
+            dict( response_functions, x = x, **response_constants )
+        )
+    else:
+        curve = response_curves[ response ]
+
+    samples       = 2 if response == 'CLAMP' else response_samples
+    interpolation = 'LINEAR' if response == 'CLAMP' else 'BEZIER'
+
+    for i in range( samples ):
+        x = i / ( samples - 1 )
+
+        try:
+            y = float( curve( x ) )
+        except ( ArithmeticError, TypeError, ValueError ) as e:
+            raise ValueError( "Response expression fails at x = %g: %s" % ( x, e ) )
+
+        points.append( ( x, y, interpolation ) )
+
+    return points
+
+def shape_response( fcurve, points ):
+    ''' Bakes the response curve's points (see response_points) into
+        keyframes on the driver's F-curve, so that the shaping is evaluated
+        natively instead of in the expression. Beyond the keyframes the
+        curve is constant, which clamps the value.
+        Returns False, without touching the curve, if it is already baked '''
+    current = [
+        ( kp.co[0], kp.co[1], kp.interpolation ) for kp in fcurve.keyframe_points
+    ]
+
+    if len( current ) == len( points ) and not ( points and len( fcurve.modifiers ) ):
+        same = all(
+            abs( c[0] - p[0] ) < 1e-6 and abs( c[1] - p[1] ) < 1e-6 and c[2] == p[2]
+            for c, p in zip( current, points )
+        )
+        if same:
+            return False
+
+    # Remove keys left by a previous response
+    while len( fcurve.keyframe_points ):
+        fcurve.keyframe_points.remove( fcurve.keyframe_points[0] )
+
+    if not points:
+        return True
+
+    # Keyframes replace the default generator modifier of new drivers
+    for mod in list( fcurve.modifiers ):
+        fcurve.modifiers.remove( mod )
+
+    fcurve.keyframe_points.add( len( points ) )
+    for kp, ( x, y, interpolation ) in zip( fcurve.keyframe_points, points ):
+        kp.co            = ( x, y )
+        kp.interpolation = interpolation
+
+        if interpolation == 'BEZIER':
+            kp.handle_left_type  = 'AUTO_CLAMPED'
+            kp.handle_right_type = 'AUTO_CLAMPED'
+
+    fcurve.extrapolation = 'CONSTANT'
+    fcurve.update()
+
+    return True
+
+def update_channel_driver( drv, rig, bone, channels, expression ):
+    ''' Makes the driver read the bone's channels (one variable named after
+        each channel) with the given expression. Only the variables and the
+        expression that differ are edited, so re-running it on an unchanged
+        driver does nothing. Returns True if the driver changed '''
+    changed = False
+
+    if drv.type != 'SCRIPTED':
+        drv.type = 'SCRIPTED'
+        changed  = True
+
+    # Remove unused channels, and duplicates stacked by older versions
+    seen = []
+    for var in list( drv.variables ):
+        if var.name not in channels or var.name in seen:
+            drv.variables.remove( var )
+            changed = True
+        else:
+            seen.append( var.name )
+
+    for opt in channels:
+        drv_var = drv.variables.get( opt )
+        if drv_var is None:
+            drv_var      = drv.variables.new()
+            drv_var.name = opt
+            changed      = True
+
+        if drv_var.type != 'TRANSFORMS':
+            drv_var.type = 'TRANSFORMS'
+            changed      = True
+
+        target = drv_var.targets[0]
+        wanted = [
+            ( 'id',              rig           ),
+            ( 'bone_target',     bone          ),
+            ( 'transform_type',  opt           ),
+            ( 'transform_space', 'LOCAL_SPACE' )
+        ]
+        for attr, value in wanted:
+            if getattr( target, attr ) != value:
+                setattr( target, attr, value )
+                changed = True
+
+    if drv.expression != expression:
+        drv.expression = expression
+        changed        = True
+
+    return changed
+
+
+# Context free versions of the operators, for pipeline scripts. They take the
+# objects to work on explicitly, and calls can be wrapped in batch_updates()
+# to update each changed mesh once when the whole batch is done.
+
+# Transform channels, in the order they appear in the drivers' expressions
+channel_names = [
+    'LOC_X',   'LOC_Y',   'LOC_Z',
+    'ROT_X',   'ROT_Y',   'ROT_Z',
+    'SCALE_X', 'SCALE_Y', 'SCALE_Z'
+]
+
+# Panel labels of the channels (rotation max values are set in degrees)
+channel_labels = [
+    'loc X',       'loc Y',       'loc Z',
+    'rot X (deg)', 'rot Y (deg)', 'rot Z (deg)',
+    'scl X',       'scl Y',       'scl Z'
+]
+
+# Channel specs of the panel's property groups, keyed by pointer. A spec is
+# read from the properties once, and served to the panel, the operators'
+# polls and driver creation until one of the channel properties changes.
+channel_spec_cache = {}
+
+def channel_spec( props ):
+    ''' Returns the channel spec of the properties, as a dict holding the
+        active ( channel, max value ) pairs with rotations in radians, and
+        the active channels that can't be used since their max value is 0 '''
+    key  = props.as_pointer()
+    spec = channel_spec_cache.get( key )
+    if spec is not None:
+        return spec
+
+    channels, invalid = [], []
+
+    for name, active, mx in zip( channel_names, props.channels, props.channel_max ):
+        if not active:
+            continue
+
+        if name.startswith( 'ROT_' ):
+            mx = math.radians( mx )
+
+        if mx == 0.0:
+            invalid.append( name )
+        else:
+            channels.append( ( name, mx ) )
+
+    spec = { 'channels' : channels, 'invalid' : invalid }
+    channel_spec_cache[ key ] = spec
+
+    return spec
+
+def channel_spec_update( self, context ):
+    channel_spec_cache.pop( self.as_pointer(), None )
+
+@persistent
+def channel_spec_reset( dummy ):
+    ''' Undo and file loads change the properties without updates '''
+    channel_spec_cache.clear()
+
+# Nesting depth of batch_updates(), and the data blocks awaiting an update
+batch_state = { 'depth' : 0, 'data' : [] }
+
+def request_update( data ):
+    ''' Updates the data block now, or at the end of the current batch '''
+    if batch_state['depth']:
+        if data not in batch_state['data']:
+            batch_state['data'].append( data )
+    else:
+        data.update()
+
+@contextmanager
+def batch_updates( scene = None ):
+    ''' Defers the mesh data updates requested by library calls made inside
+        the block, so that a mesh changed many times is updated only once.
+        When the outermost batch ends, the deferred meshes are updated, then
+        the scene is updated and the editors redrawn, once each '''
+    batch_state['depth'] += 1
+    try:
+        yield
+    finally:
+        batch_state['depth'] -= 1
+
+        if not batch_state['depth']:
+            for data in batch_state['data']:
+                data.update()
+            del batch_state['data'][:]
+
+            ( scene or bpy.context.scene ).update()
+
+            wm = bpy.context.window_manager
+            for window in ( wm.windows if wm else [] ):
+                for area in window.screen.areas:
+                    area.tag_redraw()
+
+def opposite_names( rig, bone, shapekey_name ):
+    ''' Returns the names of the opposite side's bone and shapekey for a
+        symmetrical corrective, or None if the bone has no opposite bone '''
+    pattern     = '^(\w+[-_]?\w+?)(\.)?([LR])?(\.\d*)?$'
+    bone_pieces = re.match( pattern, bone )
+
+    opposite = { 'L' : 'R', 'R' : 'L' }
+    
+    if bone_pieces:
+        groups = [ g for g in bone_pieces.groups() ]
+        
+        if groups[2]:
+            groups[2]      = opposite[ groups[2] ]
+            congroups      = [ p for p in groups if p ]
+            opposite_name  = "".join( congroups )
+            
+            shapekey_name += "." + opposite[ groups[2] ]
+            
+            if opposite_name in rig.data.bones:
+                return opposite_name, shapekey_name
+
+    return None
+
+def check_channels( channels ):
+    ''' Raises ValueError unless channels is a non empty list of ( channel,
+        max value ) pairs, with known channels and non zero max values '''
+    if not channels:
+        raise ValueError( "No driver transform channel given" )
+
+    for name, mx in channels:
+        if name not in channel_names:
+            raise ValueError( "Unknown transform channel: " + str( name ) )
+        if not mx:
+            raise ValueError( "The max value of %s can't be 0" % name )
+
+def add_corrective_driver( obj, rig, bone, shapekey_name, channels,
+                           response = 'LINEAR', response_expression = 'x',
+                           multi_target = False ):
+    ''' Creates, or updates in place, the driver of a corrective shapekey.
+        channels is a list of ( channel, max value ) pairs, the shapekey's
+        value being the average of each channel divided by its max value.
+        Rotation max values are in radians.
+        Returns True if the driver changed. Raises ValueError, before editing
+        anything, if the channels or the response expression are invalid '''
+    check_channels( channels )
+    points = response_points( response, response_expression )
+
+    if not obj.data.shape_keys:
+        obj.shape_key_add( name = 'Basis', from_mix = False )
+
+    shapekeys          = obj.data.shape_keys
+    existing_shapekeys = [ sk.name for sk in shapekeys.key_blocks ]
+
+    # If sk exists use it, else create a new one        
+    if shapekey_name not in existing_shapekeys:
+        obj.shape_key_add( name = shapekey_name, from_mix = False )
+        
+    shapekey = shapekeys.key_blocks[ shapekey_name ]
+
+    # Create driver    
+    if multi_target:
+        # Compute the weight once into a rig property, and have the
+        # shapekey (and later, matching shapekeys on other meshes) read it
+        prop = corrective_prop( shapekey_name )
+        if prop not in rig.keys():
+            rig[ prop ] = 0.0
+
+        owner = rig
+        path  = '["' + prop + '"]'
+
+        link_corrective( obj, rig, shapekey_name )
+    else:
+        owner = shapekeys
+        path  = shapekey.path_from_id( 'value' )
+
+    # Update an existing driver in place rather than stacking a new one
+    fcurve = None
+    if owner.animation_data:
+        fcurve = find_driver( owner.animation_data, path )
+    if fcurve is None:
+        fcurve = owner.driver_add( path )
+
+    expression = ""
+
+    active_options = [ opt for opt, mx in channels ]
+    last = len( active_options )
+
+    i = 1
+    for opt, mx in channels:
+        convertor = str( round( mx, 3 ) )
+            
+        if last == 1:
+            expression = opt + "/" + convertor
+        elif i == 1:
+            expression += "(" + opt + "/" + convertor
+        elif i == last:
+            expression += "+" + opt + "/" + convertor + ")"
+            expression += "/" + str(last)
+        else:
+            expression += "+" + opt + "/" + convertor
+        
+        i += 1
+
+    changed = update_channel_driver(
+        fcurve.driver, rig, bone, active_options, expression
+    )
+
+    changed |= shape_response( fcurve, points )
+
+    if changed:
+        update_driver_index( obj, shapekey_name )
+
+    return changed
+
+def add_corrective_drivers( obj, rig, specs ):
+    ''' Creates or updates the drivers of many correctives on a mesh in one
+        batch. Each spec is a dict with a 'shapekey', a 'bone' and 'channels'
+        ( { channel : max value }, rotation max values in radians), and
+        optionally a 'response', 'response_expression', 'multi_target' and
+        'symmetrize'. Raises ValueError, before editing anything, if the
+        channels or the response of a spec are invalid '''
+    spec_channels = []
+    for spec in specs:
+        unknown = [ c for c in spec['channels'] if c not in channel_names ]
+        if unknown:
+            raise ValueError( "Unknown transform channel: " + unknown[0] )
+
+        channels = [
+            ( c, spec['channels'][ c ] ) for c in channel_names
+            if c in spec['channels']
+        ]
+        check_channels( channels )
+        response_points(
+            spec.get( 'response', 'LINEAR' ), spec.get( 'response_expression', 'x' )
+        )
+
+        spec_channels.append( channels )
+
+    with batch_updates():
+        for spec, channels in zip( specs, spec_channels ):
+            options = {
+                'response'            : spec.get( 'response', 'LINEAR' ),
+                'response_expression' : spec.get( 'response_expression', 'x' ),
+                'multi_target'        : spec.get( 'multi_target', False )
+            }
+
+            add_corrective_driver(
+                obj, rig, spec['bone'], spec['shapekey'], channels, **options
+            )
+
+            if not spec.get( 'symmetrize' ):
+                continue
+
+            names = opposite_names( rig, spec['bone'], spec['shapekey'] )
+            if names:
+                # Hand edits on an existing opposite shapekey are kept
+                empty = shapekey_is_empty( obj, names[1] )
+
+                add_corrective_driver(
+                    obj, rig, names[0], names[1], channels, **options
+                )
+
+                # Fill the new opposite shapekey with the mirrored sculpt
+                if empty:
+                    mirror_shapekey( obj, spec['shapekey'], names[1] )
+
+def link_correctives( rig, meshes ):
+    ''' Links the shapekeys of all meshes that match one of the rig's multi
+        target correctives to it. Returns the number of linked shapekeys '''
+    names = [
+        k[ len( corrective_prefix ): ] for k in rig.keys()
+        if k.startswith( corrective_prefix )
+    ]
+
+    linked = 0
+    with batch_updates():
+        for obj in meshes:
+            if not obj.data.shape_keys:
+                continue
+
+            key_blocks = obj.data.shape_keys.key_blocks
+            for name in names:
+                if name in key_blocks:
+                    link_corrective( obj, rig, name )
+                    linked += 1
+
+    return linked
+
 
 class CreateDriver( bpy.types.Operator ):
     """ Create the driver based on the current bone's maximal position """
@@ -183,21 +1110,9 @@ class CreateDriver( bpy.types.Operator ):
     @classmethod
     def poll( self, context ):
         drv_sk_props = context.scene.corrective_drivenkeys_props
-        
-        driver_options = {
-                'LOC_X'   : [ drv_sk_props.locX, drv_sk_props.locXmax ],
-                'LOC_Y'   : [ drv_sk_props.locY, drv_sk_props.locYmax ],  
-                'LOC_Z'   : [ drv_sk_props.locZ, drv_sk_props.locZmax ],
-                'ROT_X'   : [ drv_sk_props.rotX, drv_sk_props.rotXmax ],
-                'ROT_Y'   : [ drv_sk_props.rotY, drv_sk_props.rotYmax ],
-                'ROT_Z'   : [ drv_sk_props.rotZ, drv_sk_props.rotZmax ],
-                'SCALE_X' : [ drv_sk_props.sclX, drv_sk_props.sclXmax ],
-                'SCALE_Y' : [ drv_sk_props.sclY, drv_sk_props.sclYmax ],
-                'SCALE_Z' : [ drv_sk_props.sclZ, drv_sk_props.sclZmax ]
-        }
+        spec         = channel_spec( drv_sk_props )
 
         obj = context.object
-        active_options = [ o for o in driver_options if driver_options[ o ][0] ]
         
         # If the object is of the correct type 
         if obj.type == 'ARMATURE':
@@ -205,8 +1120,9 @@ class CreateDriver( bpy.types.Operator ):
             if obj.mode == 'POSE':
                 # and if there's exactly 1 pose bone selected
                 if len( [ b for b in obj.data.bones if b.select ] ) == 1:
-                    # Ensure the user chose at least one driver transform chan.
-                    if len( active_options ) > 0:
+                    # Ensure the user chose at least one driver transform
+                    # channel, and all chosen channels have a max value
+                    if spec['channels'] and not spec['invalid']:
                         # then enable this operator
                         return True
         return False
@@ -214,61 +1130,13 @@ class CreateDriver( bpy.types.Operator ):
     def create_driver( self, context, obj, rig, bone, shapekey_name ):
         drv_sk_props = context.scene.corrective_drivenkeys_props
 
-        driver_options = {
-                'LOC_X'   : [ drv_sk_props.locX, drv_sk_props.locXmax ],
-                'LOC_Y'   : [ drv_sk_props.locY, drv_sk_props.locYmax ],  
-                'LOC_Z'   : [ drv_sk_props.locZ, drv_sk_props.locZmax ],
-                'ROT_X'   : [ drv_sk_props.rotX, drv_sk_props.rotXmax ],
-                'ROT_Y'   : [ drv_sk_props.rotY, drv_sk_props.rotYmax ],
-                'ROT_Z'   : [ drv_sk_props.rotZ, drv_sk_props.rotZmax ],
-                'SCALE_X' : [ drv_sk_props.sclX, drv_sk_props.sclXmax ],
-                'SCALE_Y' : [ drv_sk_props.sclY, drv_sk_props.sclYmax ],
-                'SCALE_Z' : [ drv_sk_props.sclZ, drv_sk_props.sclZmax ]
-        }
-                  
-        shapekeys          = obj.data.shape_keys
-        existing_shapekeys = [ sk.name for sk in shapekeys.key_blocks ]
-
-        # If sk exists use it, else create a new one        
-        if shapekey_name not in existing_shapekeys:
-            obj.shape_key_add( name = shapekey_name, from_mix = False )
-            
-        shapekey = shapekeys.key_blocks[ shapekey_name ]
+        channels = channel_spec( drv_sk_props )['channels']
 
-        # Create driver    
-        drv      = shapekey.driver_add( "value" ).driver
-        drv.type = 'SCRIPTED'        
-
-        expression = ""
-
-        active_options = [ o for o in driver_options if driver_options[ o ][0] ]
-        last = len( active_options )
-
-        i = 1
-        for opt in active_options:
-            drv_var                            = drv.variables.new()
-            drv_var.name                       = opt
-            drv_var.type                       = 'TRANSFORMS'
-            drv_var.targets[0].id              = rig
-            drv_var.targets[0].bone_target     = bone
-            drv_var.targets[0].transform_type  = opt
-            drv_var.targets[0].transform_space = 'LOCAL_SPACE'       
-           
-            convertor = str( round( driver_options[ opt ][1], 3 ) )
-                
-            if last == 1:
-                expression = opt + "/" + convertor
-            elif i == 1:
-                expression += "(" + opt + "/" + convertor
-            elif i == last:
-                expression += "+" + opt + "/" + convertor + ")"
-                expression += "/" + str(last)
-            else:
-                expression += "+" + opt + "/" + convertor
-            
-            i += 1
-  
-        drv.expression = expression
+        add_corrective_driver(
+            obj, rig, bone, shapekey_name, channels,
+            drv_sk_props.response, drv_sk_props.response_expression,
+            drv_sk_props.multi_target
+        )
 
         return {'FINISHED'}        
     
@@ -283,119 +1151,831 @@ class CreateDriver( bpy.types.Operator ):
 
         shapekey_name = drv_sk_props.update_shapekey
 
-        self.create_driver( context, obj, rig, bone, shapekey_name )
-        
-        if drv_sk_props.symmetrize:
-            pattern     = '^(\w+[-_]?\w+?)(\.)?([LR])?(\.\d*)?$'
-            bone_pieces = re.match( pattern, bone )
+        # Test the response before any driver gets edited
+        try:
+            response_points( drv_sk_props.response, drv_sk_props.response_expression )
+        except ValueError as e:
+            self.report( {'ERROR'}, str( e ) )
+            return {'CANCELLED'}
 
-            opposite = { 'L' : 'R', 'R' : 'L' }
+        with batch_updates( context.scene ):
+            self.create_driver( context, obj, rig, bone, shapekey_name )
             
-            if bone_pieces:
-                groups = [ g for g in bone_pieces.groups() ]
+            if drv_sk_props.symmetrize:
+                names = opposite_names( rig, bone, shapekey_name )
                 
-                if groups[2]:
-                    groups[2]      = opposite[ groups[2] ]
-                    congroups      = [ p for p in groups if p ]
-                    opposite_name  = "".join( congroups )
-                    
-                    shapekey_name += "." + opposite[ groups[2] ]
-                    
-                    if opposite_name in [ b.name for b in rig.data.bones ]:
-                        self.create_driver( context, obj, rig, opposite_name, shapekey_name )
+                if names:
+                    # Hand edits on an existing opposite shapekey are kept
+                    empty = shapekey_is_empty( obj, names[1] )
+
+                    self.create_driver( context, obj, rig, names[0], names[1] )
+
+                    # Fill the new opposite shapekey with the mirrored sculpt
+                    if empty:
+                        mirror_shapekey( obj, shapekey_name, names[1] )
 
         return {'FINISHED'} 
 
-class correctiveDrivenkeysProps( bpy.types.PropertyGroup ):
-    # These two will be used to select existing objects
-    # and shapekeys to add drivers to
-    mesh_object     = bpy.props.StringProperty()
-    update_shapekey = bpy.props.StringProperty()
-    
-    # Driver options
-    locX = bpy.props.BoolProperty(
-        name        = "locX",
-        description = "use X location for driving the shapekey", 
-        default     = False
-    )
-    locXmax = bpy.props.FloatProperty(
-        name        = "locXmax", 
-        description = "value for full shapekey activation" 
-    )
-    locY = bpy.props.BoolProperty(
-        name        = "locY",
-        description = "use Y location for driving the shapekey", 
-        default     = False
-    ) 
-    locYmax = bpy.props.FloatProperty(
-        name        = "locYmax", 
-        description = "value for full shapekey activation" 
-    ) 
-    locZ = bpy.props.BoolProperty(
-        name        = "locZ",
-        description = "use Z location for driving the shapekey", 
-        default     = False
-    )
-    locZmax = bpy.props.FloatProperty(
-        name        = "locZmax", 
-        description = "value for full shapekey activation" 
-    )
-    rotX = bpy.props.BoolProperty(
-        name        = "rotX",
-        description = "use X rotation (degrees) for driving the shapekey", 
-        default     = False
-    )
-    rotXmax = bpy.props.FloatProperty(
-        name        = "rotXmax", 
-        description = "value for full shapekey activation",
-        subtype     = 'ANGLE'
+class ExtractCorrective( bpy.types.Operator ):
+    """ Extract a corrective shapekey from a sculpt of the mesh in the current pose """
+    bl_idname      = "armature.extract_corrective"
+    bl_label       = "Extract corrective from sculpt"
+    bl_description = "Compute the rest space corrective from a posed sculpt and drive it"
+    bl_options     = { 'REGISTER', 'UNDO' }
+
+    @classmethod
+    def poll( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+        objects      = context.scene.objects
+
+        # A shapekey and a mesh to take the sculpted shape from must be chosen
+        if not drv_sk_props.update_shapekey:
+            return False
+        if drv_sk_props.sculpt_object not in objects:
+            return False
+        if objects[ drv_sk_props.sculpt_object ].type != 'MESH':
+            return False
+
+        return CreateDriver.poll( context )
+
+    def execute( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        obj    = context.scene.objects[ drv_sk_props.mesh_object ]
+        sculpt = context.scene.objects[ drv_sk_props.sculpt_object ]
+        rig    = context.object
+
+        bone          = [ b.name for b in rig.data.bones if b.select ].pop()
+        shapekey_name = drv_sk_props.update_shapekey
+
+        try:
+            response_points( drv_sk_props.response, drv_sk_props.response_expression )
+        except ValueError as e:
+            self.report( {'ERROR'}, str( e ) )
+            return {'CANCELLED'}
+
+        if not obj.data.shape_keys:
+            obj.shape_key_add( name = 'Basis', from_mix = False )
+        if shapekey_name not in obj.data.shape_keys.key_blocks:
+            obj.shape_key_add( name = shapekey_name, from_mix = False )
+
+        try:
+            extract_corrective( context, obj, rig, sculpt, shapekey_name )
+        except RuntimeError as e:
+            self.report( {'ERROR'}, str( e ) )
+            return {'CANCELLED'}
+
+        add_corrective_driver(
+            obj, rig, bone, shapekey_name, channel_spec( drv_sk_props )['channels'],
+            drv_sk_props.response, drv_sk_props.response_expression,
+            drv_sk_props.multi_target
+        )
+
+        return {'FINISHED'}
+
+
+class LinkCorrectives( bpy.types.Operator ):
+    """ Link the rig's correctives to matching shapekeys on selected meshes """
+    bl_idname      = "armature.link_correctives"
+    bl_label       = "Link correctives to selected meshes"
+    bl_description = "Drive matching shapekeys of all selected meshes by the rig's corrective properties"
+    bl_options     = { 'REGISTER', 'UNDO' }
+
+    @classmethod
+    def poll( self, context ):
+        obj = context.object
+        if obj.type == 'ARMATURE' and obj.mode == 'POSE':
+            # The rig must have at least one multi target corrective
+            return any( k.startswith( corrective_prefix ) for k in obj.keys() )
+        return False
+
+    def execute( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        rig = context.object
+
+        meshes = [ o for o in context.selected_objects if o.type == 'MESH' ]
+        if drv_sk_props.mesh_object in context.scene.objects:
+            mesh = context.scene.objects[ drv_sk_props.mesh_object ]
+            if mesh.type == 'MESH' and mesh not in meshes:
+                meshes.append( mesh )
+
+        with batch_updates( context.scene ):
+            linked = link_correctives( rig, meshes )
+
+        self.report( {'INFO'}, "Linked %d shapekeys" % linked )
+
+        return {'FINISHED'}
+
+
+# Pose space solvers the drivers were built with, keyed by the mesh's
+# 'pose_space_id' property, which the drivers read through a variable (so
+# they follow renames and duplicates of the mesh). Each entry holds the bones and keys the drivers' arguments refer to, the RBF
+# centers and weights of all the mesh's pose space correctives, plus the last
+# evaluated pose so that the mesh's drivers share a single evaluation. Editing
+# the samples doesn't touch it: the solver is only replaced, and stored in the
+# mesh's 'pose_space_solver' property, when the drivers are recreated.
+pose_space_cache = {}
+
+def pose_space_bones( obj ):
+    ''' Returns the sorted names of the bones that drive a mesh's pose space '''
+    return sorted( set( s.bone for s in obj.pose_space.samples if s.bone ) )
+
+def pose_space_keys( obj ):
+    ''' Returns the names of the shapekeys driven by a mesh's pose space '''
+    keys = []
+    for s in obj.pose_space.samples:
+        if s.shapekey and s.shapekey not in keys:
+            keys.append( s.shapekey )
+    return keys
+
+def pose_space_hash( obj ):
+    ''' Returns a hash of the mesh's samples (bones, poses, shapekeys and
+        weights), telling whether the drivers' solver is still up to date '''
+    ident = hashlib.md5()
+    for s in obj.pose_space.samples:
+        sample = '%s:%s:%s:%.6f;' % ( s.bone, s.pose, s.shapekey, s.weight )
+        ident.update( sample.encode() )
+    return ident.hexdigest()
+
+def pose_features( rig, bones, pose_name ):
+    ''' Reads the local rotation of each bone from a pose library pose, and
+        returns them as a flat list of euler angles (3 values per bone) '''
+    lib    = rig.pose_library
+    frame  = lib.pose_markers[ pose_name ].frame
+    curves = { ( fc.data_path, fc.array_index ) : fc for fc in lib.fcurves }
+
+    features = []
+    for bone in bones:
+        pb    = rig.pose.bones[ bone ]
+        base  = 'pose.bones["' + bone + '"].'
+        quat  = [ 1.0, 0.0, 0.0, 0.0 ]
+        euler = [ 0.0, 0.0, 0.0 ]
+
+        # Channels not stored in the pose are at their rest value
+        for i in range( 4 ):
+            fc = curves.get( ( base + 'rotation_quaternion', i ) )
+            if fc:
+                quat[ i ] = fc.evaluate( frame )
+        for i in range( 3 ):
+            fc = curves.get( ( base + 'rotation_euler', i ) )
+            if fc:
+                euler[ i ] = fc.evaluate( frame )
+
+        if pb.rotation_mode == 'QUATERNION':
+            euler = Quaternion( quat ).to_euler()
+
+        features.extend( euler )
+
+    return features
+
+def rbf_kernel( dist, sigma ):
+    ''' Gaussian radial basis function '''
+    return np.exp( -( dist / sigma ) ** 2 )
+
+def solve_pose_space( obj ):
+    ''' Solves the RBF weight matrix of all pose space correctives on a mesh
+        from its current samples '''
+    ps    = obj.pose_space
+    rig   = bpy.data.objects[ ps.rig ]
+    bones = pose_space_bones( obj )
+    keys  = pose_space_keys( obj )
+
+    # Each sample pose fully activates its shapekey. Samples sharing a pose
+    # are merged into one center, and the rest pose is an implicit sample
+    # where all correctives are off.
+    poses = [ '' ]
+    rows  = [ [ 0.0 ] * len( keys ) ]
+    for s in ps.samples:
+        if s.pose not in poses:
+            poses.append( s.pose )
+            rows.append( [ 0.0 ] * len( keys ) )
+        rows[ poses.index( s.pose ) ][ keys.index( s.shapekey ) ] = s.weight
+
+    centers = [ [ 0.0 ] * 3 * len( bones ) ]
+    centers += [ pose_features( rig, bones, p ) for p in poses[1:] ]
+
+    centers = np.array( centers, dtype = float )
+    targets = np.array( rows,    dtype = float )
+
+    dist  = np.linalg.norm( centers[ :, None ] - centers[ None, : ], axis = 2 )
+    
+    # The kernel's width is the average distance between samples
+    sigma = dist[ dist > 0 ].mean() if ( dist > 0 ).any() else 1.0
+    phi   = rbf_kernel( dist, sigma )
+
+    # A tiny regularization keeps nearly identical samples solvable
+    weights = np.linalg.solve( phi + np.eye( len( phi ) ) * 1e-8, targets )
+
+    return {
+        'samples' : pose_space_hash( obj ),
+        'bones'   : bones,
+        'keys'    : keys,
+        'centers' : centers,
+        'sigma'   : float( sigma ),
+        'weights' : weights,
+        'pose'    : None,
+        'values'  : None
+    }
+
+def store_pose_space( obj, solver ):
+    ''' Saves the solver the drivers are built with in the mesh's
+        'pose_space_solver' ID property, and serves it to the drivers.
+        Names are stored as { name : index } groups, since ID properties
+        can't hold lists of strings. Each stored solver gets a new id, so
+        duplicates of the mesh keep sharing a solver only while its data
+        is the same '''
+    ids = [ o.get( 'pose_space_id', 0 ) for o in bpy.data.objects ]
+
+    obj[ 'pose_space_id' ]     = max( ids ) + 1
+    obj[ 'pose_space_solver' ] = {
+        'samples' : solver['samples'],
+        'bones'   : { name : i for i, name in enumerate( solver['bones'] ) },
+        'keys'    : { name : i for i, name in enumerate( solver['keys']  ) },
+        'centers' : solver['centers'].ravel().tolist(),
+        'weights' : solver['weights'].ravel().tolist(),
+        'sigma'   : solver['sigma']
+    }
+    pose_space_cache[ obj[ 'pose_space_id' ] ] = solver
+
+def load_pose_space( obj ):
+    ''' Returns the solver the mesh's drivers were built with, or None '''
+    mesh_id = obj.get( 'pose_space_id' )
+    stored  = obj.get( 'pose_space_solver' )
+    if mesh_id is None or stored is None:
+        return None
+
+    solver = pose_space_cache.get( mesh_id )
+    if solver is not None:
+        return solver
+
+    bones = sorted( stored['bones'].keys(), key = lambda n: stored['bones'][ n ] )
+    keys  = sorted( stored['keys'].keys(),  key = lambda n: stored['keys'][ n ]  )
+
+    solver = {
+        'samples' : stored.get( 'samples', '' ),
+        'bones'   : bones,
+        'keys'    : keys,
+        'centers' : np.array( stored['centers'], dtype = float ).reshape( -1, 3 * len( bones ) ),
+        'sigma'   : stored['sigma'],
+        'weights' : np.array( stored['weights'], dtype = float ).reshape( -1, len( keys ) ),
+        'pose'    : None,
+        'values'  : None
+    }
+    pose_space_cache[ mesh_id ] = solver
+
+    return solver
+
+def pose_space( mesh_id, key_index, *features ):
+    ''' Driver function: returns the value of a single pose space corrective.
+        mesh_id is the mesh's 'pose_space_id', read by the driver's 'mesh'
+        variable. All of the mesh's correctives are evaluated together, and
+        the result is reused by the other drivers for as long as the pose is
+        unchanged. Raises ValueError if the driver doesn't match the solver '''
+    mesh_id = int( round( mesh_id ) )
+
+    solver = pose_space_cache.get( mesh_id )
+    if solver is None:
+        # Any mesh holding this id holds the same stored solver
+        for obj in bpy.data.objects:
+            if obj.get( 'pose_space_id' ) == mesh_id:
+                solver = load_pose_space( obj )
+                break
+
+    if solver is None:
+        raise ValueError( "No pose space solver with id %d" % mesh_id )
+
+    if len( features ) != 3 * len( solver['bones'] ) or \
+       not 0 <= key_index < len( solver['keys'] ):
+        raise ValueError( "Pose space drivers are out of date, recreate them" )
+
+    if solver['pose'] != features:
+        dist = np.linalg.norm( solver['centers'] - features, axis = 1 )
+        phi  = rbf_kernel( dist, solver['sigma'] )
+
+        solver['values'] = np.clip( phi.dot( solver['weights'] ), 0.0, 1.0 )
+        solver['pose']   = features
+
+    return float( solver['values'][ key_index ] )
+
+def create_pose_space_drivers( obj ):
+    ''' (Re)creates the drivers of all pose space correctives on a mesh,
+        solved from its current samples '''
+    solver = solve_pose_space( obj )
+    rig    = bpy.data.objects[ obj.pose_space.rig ]
+
+    store_pose_space( obj, solver )
+
+    if not obj.data.shape_keys:
+        obj.shape_key_add( name = 'Basis', from_mix = False )
+
+    key_blocks = obj.data.shape_keys.key_blocks
+
+    for i, key in enumerate( solver['keys'] ):
+        if key not in key_blocks:
+            obj.shape_key_add( name = key, from_mix = False )
+
+        shapekey = key_blocks[ key ]
+
+        # Bones may have been added to the pose space since the driver was
+        # created, so it is always rebuilt from scratch
+        shapekey.driver_remove( "value" )
+
+        drv      = shapekey.driver_add( "value" ).driver
+        drv.type = 'SCRIPTED'
+
+        args = []
+        for b, bone in enumerate( solver['bones'] ):
+            for axis in [ 'X', 'Y', 'Z' ]:
+                drv_var                            = drv.variables.new()
+                drv_var.name                       = axis.lower() + str( b )
+                drv_var.type                       = 'TRANSFORMS'
+                drv_var.targets[0].id              = rig
+                drv_var.targets[0].bone_target     = bone
+                drv_var.targets[0].transform_type  = 'ROT_' + axis
+                drv_var.targets[0].transform_space = 'LOCAL_SPACE'
+
+                args.append( drv_var.name )
+
+        # The mesh is passed by id rather than by name, so that renaming
+        # or duplicating it doesn't break the drivers
+        drv_var                      = drv.variables.new()
+        drv_var.name                 = 'mesh'
+        drv_var.type                 = 'SINGLE_PROP'
+        drv_var.targets[0].id        = obj
+        drv_var.targets[0].data_path = '["pose_space_id"]'
+
+        drv.expression = "pose_space(mesh,%d,%s)" % ( i, ",".join( args ) )
+
+        update_driver_index( obj, key )
+
+@persistent
+def pose_space_load( dummy ):
+    ''' Drops solvers of the previous file and exposes the driver function '''
+    pose_space_cache.clear()
+    bpy.app.driver_namespace['pose_space'] = pose_space
+
+@persistent
+def pose_space_undo( dummy ):
+    ''' Undo can bring back solvers that were replaced since they were cached '''
+    pose_space_cache.clear()
+
+
+class PoseSpacePanel(bpy.types.Panel):
+    bl_idname      = "PoseSpacePanel"
+    bl_label       = "Pose space samples"
+    bl_space_type  = 'VIEW_3D'
+    bl_region_type = 'TOOLS'
+    bl_context     = 'posemode'
+
+    @classmethod
+    def poll( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+        name         = drv_sk_props.mesh_object
+
+        if drv_sk_props.driver_type != 'POSE_SPACE':
+            return False
+
+        if name in [ obj.name for obj in context.scene.objects ]:
+            return context.scene.objects[ name ].type == 'MESH'
+        return False
+
+    def draw( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        layout = self.layout
+
+        obj = context.scene.objects[ drv_sk_props.mesh_object ]
+        rig = context.object
+
+        col = layout.column()
+
+        if rig.pose_library:
+            col.prop_search(
+                drv_sk_props,     "pose_marker", # Pick a pose out of the
+                rig.pose_library, "pose_markers" # rig's pose library
+            )
+        else:
+            col.label( text = "The rig has no pose library" )
+
+        col.operator( 'armature.add_pose_space_sample' )
+
+        col.separator()
+
+        # Each sample gets a row showing its bone, pose and shapekey
+        for i, s in enumerate( obj.pose_space.samples ):
+            row = col.row()
+            row.label( text = s.bone + " | " + s.pose + " | " + s.shapekey )
+            row.prop( s, "weight", text = "" )
+            op = row.operator(
+                'armature.remove_pose_space_sample', text = "", icon = 'X'
+            )
+            op.index = i
+
+        col.separator()
+
+        # Sample edits only reach the drivers once they are recreated
+        solver = load_pose_space( obj )
+        if solver and solver['samples'] != pose_space_hash( obj ):
+            col.label( text = "Samples changed, recreate the drivers", icon = 'ERROR' )
+
+        col.operator( 'armature.create_pose_space_drivers' )
+
+
+class AddPoseSpaceSample( bpy.types.Operator ):
+    """ Add the chosen pose as a sample of the selected bone and shapekey """
+    bl_idname      = "armature.add_pose_space_sample"
+    bl_label       = "Add pose sample"
+    bl_description = "Add pose sample"
+    bl_options     = { 'REGISTER', 'UNDO' }
+
+    @classmethod
+    def poll( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+        obj          = context.object
+
+        if obj.type == 'ARMATURE' and obj.mode == 'POSE':
+            if len( [ b for b in obj.data.bones if b.select ] ) == 1:
+                # A pose and a shapekey must be chosen
+                return drv_sk_props.pose_marker and drv_sk_props.update_shapekey
+        return False
+
+    def execute( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        obj = context.scene.objects[ drv_sk_props.mesh_object ]
+        rig = context.object
+
+        obj.pose_space.rig = rig.name
+
+        sample          = obj.pose_space.samples.add()
+        sample.bone     = [ b.name for b in rig.data.bones if b.select ].pop()
+        sample.pose     = drv_sk_props.pose_marker
+        sample.shapekey = drv_sk_props.update_shapekey
+
+        return {'FINISHED'}
+
+
+class RemovePoseSpaceSample( bpy.types.Operator ):
+    """ Remove a pose space sample """
+    bl_idname      = "armature.remove_pose_space_sample"
+    bl_label       = "Remove pose sample"
+    bl_description = "Remove pose sample"
+    bl_options     = { 'REGISTER', 'UNDO' }
+
+    index = bpy.props.IntProperty()
+
+    def execute( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        obj = context.scene.objects[ drv_sk_props.mesh_object ]
+        obj.pose_space.samples.remove( self.index )
+
+        return {'FINISHED'}
+
+
+class CreatePoseSpaceDrivers( bpy.types.Operator ):
+    """ Solve the pose space and create drivers for all its correctives """
+    bl_idname      = "armature.create_pose_space_drivers"
+    bl_label       = "Create pose space drivers"
+    bl_description = "Create pose space drivers"
+    bl_options     = { 'REGISTER', 'UNDO' }
+
+    @classmethod
+    def poll( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+        obj          = context.scene.objects.get( drv_sk_props.mesh_object )
+
+        return obj is not None and len( obj.pose_space.samples ) > 0
+
+    def execute( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        obj = context.scene.objects[ drv_sk_props.mesh_object ]
+
+        create_pose_space_drivers( obj )
+
+        return {'FINISHED'}
+
+
+class PoseSpaceSample( bpy.types.PropertyGroup ):
+    # Bone, pose library pose, and the shapekey fully active in that pose
+    bone     = bpy.props.StringProperty()
+    pose     = bpy.props.StringProperty()
+    shapekey = bpy.props.StringProperty()
+
+    weight = bpy.props.FloatProperty(
+        name        = "weight",
+        description = "shapekey value at this pose",
+        default     = 1.0,
+        min         = 0.0,
+        max         = 1.0
     )
-    rotY = bpy.props.BoolProperty(
-        name        = "rotY",
-        description = "use Y rotation (degrees) for driving the shapekey", 
-        default     = False
+
+class PoseSpaceProps( bpy.types.PropertyGroup ):
+    rig     = bpy.props.StringProperty()
+    samples = bpy.props.CollectionProperty( type = PoseSpaceSample )
+
+# A corrective's tier is the number of these thresholds its impact (largest
+# vertex offset) reaches, relative to the mesh's most impactful corrective
+impact_thresholds = [ 0.02, 0.1, 0.5 ]
+
+def corrective_tiers( obj ):
+    ''' Computes the impact tier (0 - 3) of every corrective on the mesh from
+        its largest vertex offset, and stores them on the object. Only
+        shapekeys driven by bone channels (directly, through a multi target
+        property or by the pose space) are correctives, other shapekeys are
+        left out so that simplify never mutes them '''
+    key_blocks = obj.data.shape_keys.key_blocks
+    count      = len( obj.data.vertices )
+
+    correctives = set(
+        name for shapekeys in get_driver_index( obj ).values() for name in shapekeys
     )
-    rotYmax = bpy.props.FloatProperty(
-        name        = "rotYmax", 
-        description = "value for full shapekey activation",
-        subtype     = 'ANGLE'
+
+    co    = np.empty( count * 3, dtype = np.float32 )
+    basis = np.empty( count * 3, dtype = np.float32 )
+
+    impacts = {}
+    for kb in key_blocks:
+        # Skip the reference key and shapekeys that aren't correctives
+        if kb.relative_key == kb or kb.name not in correctives:
+            continue
+
+        kb.data.foreach_get( 'co', co )
+        kb.relative_key.data.foreach_get( 'co', basis )
+
+        delta              = ( co - basis ).reshape( count, 3 )
+        impacts[ kb.name ] = float( np.sqrt( ( delta ** 2 ).sum( axis = 1 ).max() ) )
+
+    largest = max( impacts.values() ) if impacts else 0.0
+
+    tiers = {}
+    for name, impact in impacts.items():
+        tiers[ name ] = sum(
+            1 for t in impact_thresholds if largest and impact >= t * largest
+        )
+
+    obj[ 'corrective_tiers' ] = tiers
+
+    return tiers
+
+def simplify_correctives( scene, min_tier ):
+    ''' Mutes the shapekeys (and their drivers) of all correctives below
+        the given tier in the scene, and unmutes the rest of the ones muted
+        by a previous call. A tier of 0 restores all correctives '''
+    for obj in scene.objects:
+        tiers = obj.get( 'corrective_tiers' )
+        if obj.type != 'MESH' or not tiers or not obj.data.shape_keys:
+            continue
+
+        key = obj.data.shape_keys
+        if key.library:
+            continue
+
+        drivers = {}
+        if key.animation_data:
+            drivers = { fc.data_path : fc for fc in key.animation_data.drivers }
+
+        # Only correctives muted here are unmuted, manual mutes are kept. The
+        # muted names are stored as the keys of an ID property group
+        muted = set( key.get( 'simplify_muted', {} ).keys() )
+
+        for name, tier in tiers.items():
+            kb = key.key_blocks.get( name )
+            if not kb:
+                continue
+
+            off = tier < min_tier
+            if off == ( name in muted ):
+                continue
+
+            fc = drivers.get( kb.path_from_id( 'value' ) )
+            if fc:
+                fc.mute = off
+            kb.mute = off
+
+            if off:
+                muted.add( name )
+            else:
+                muted.discard( name )
+
+        key[ 'simplify_muted' ] = { name : 1 for name in muted }
+
+def simplify_tier( scene ):
+    ''' Returns the tier below which correctives are muted (0 when off) '''
+    drv_sk_props = scene.corrective_drivenkeys_props
+    return drv_sk_props.simplify_tier if drv_sk_props.simplify else 0
+
+def simplify_update( self, context ):
+    simplify_correctives( context.scene, simplify_tier( context.scene ) )
+
+@persistent
+def simplify_render_pre( scene ):
+    ''' Renders always use all correctives '''
+    if scene.corrective_drivenkeys_props.simplify:
+        simplify_correctives( scene, 0 )
+
+@persistent
+def simplify_render_post( scene ):
+    if scene.corrective_drivenkeys_props.simplify:
+        simplify_correctives( scene, simplify_tier( scene ) )
+
+@persistent
+def simplify_save_pre( dummy ):
+    ''' Saved files always use all correctives, so that they evaluate fully
+        on machines without this addon '''
+    for scene in bpy.data.scenes:
+        simplify_correctives( scene, 0 )
+
+@persistent
+def simplify_save_post( dummy ):
+    for scene in bpy.data.scenes:
+        if scene.corrective_drivenkeys_props.simplify:
+            simplify_correctives( scene, simplify_tier( scene ) )
+
+@contextmanager
+def all_correctives( scene ):
+    ''' Restores all the scene's correctives inside the block, for bakes and
+        exports that step through frames without the render handlers '''
+    simplify_correctives( scene, 0 )
+    try:
+        yield
+    finally:
+        props = getattr( scene, 'corrective_drivenkeys_props', None )
+        if props and props.simplify:
+            simplify_correctives( scene, simplify_tier( scene ) )
+
+
+class SimplifyPanel(bpy.types.Panel):
+    bl_idname      = "SimplifyPanel"
+    bl_label       = "Simplify correctives"
+    bl_space_type  = 'VIEW_3D'
+    bl_region_type = 'TOOLS'
+    bl_context     = 'posemode'
+
+    def draw( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        layout = self.layout
+
+        col = layout.column()
+
+        col.prop( drv_sk_props, 'simplify' )
+
+        row = col.row()
+        row.active = drv_sk_props.simplify
+        row.prop( drv_sk_props, 'simplify_tier' )
+
+        col.operator( 'object.compute_corrective_tiers' )
+
+
+class ComputeCorrectiveTiers( bpy.types.Operator ):
+    """ Rate the chosen mesh's correctives by their impact for simplify """
+    bl_idname      = "object.compute_corrective_tiers"
+    bl_label       = "Compute corrective tiers"
+    bl_description = "Rate the chosen mesh's correctives by their vertex offsets"
+    bl_options     = { 'REGISTER', 'UNDO' }
+
+    @classmethod
+    def poll( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+        obj          = context.scene.objects.get( drv_sk_props.mesh_object )
+
+        return obj is not None and obj.type == 'MESH' and obj.data.shape_keys
+
+    def execute( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        obj = context.scene.objects[ drv_sk_props.mesh_object ]
+
+        tiers = corrective_tiers( obj )
+
+        # Re-apply simplify with the new tiers
+        simplify_correctives( context.scene, simplify_tier( context.scene ) )
+
+        self.report( {'INFO'}, "Rated %d correctives" % len( tiers ) )
+
+        return {'FINISHED'}
+
+
+class ChannelPreset( bpy.types.PropertyGroup ):
+    # A saved copy of the panel's channels and max values
+    channels    = bpy.props.BoolVectorProperty(  size = len( channel_names ) )
+    channel_max = bpy.props.FloatVectorProperty( size = len( channel_names ) )
+
+
+class SaveChannelPreset( bpy.types.Operator ):
+    """ Save the current channels and max values as a preset """
+    bl_idname      = "armature.save_channel_preset"
+    bl_label       = "Save preset"
+    bl_description = "Save the current channels and max values as a preset"
+    bl_options     = { 'REGISTER', 'UNDO' }
+
+    @classmethod
+    def poll( self, context ):
+        return context.scene.corrective_drivenkeys_props.preset_name
+
+    def execute( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+        presets      = drv_sk_props.channel_presets
+
+        preset = presets.get( drv_sk_props.preset_name )
+        if preset is None:
+            preset      = presets.add()
+            preset.name = drv_sk_props.preset_name
+
+        preset.channels    = drv_sk_props.channels[:]
+        preset.channel_max = drv_sk_props.channel_max[:]
+
+        return {'FINISHED'}
+
+
+class LoadChannelPreset( bpy.types.Operator ):
+    """ Set the channels and max values from a preset """
+    bl_idname      = "armature.load_channel_preset"
+    bl_label       = "Load preset"
+    bl_description = "Set the channels and max values from a preset"
+    bl_options     = { 'REGISTER', 'UNDO' }
+
+    @classmethod
+    def poll( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+        return drv_sk_props.preset_name in drv_sk_props.channel_presets
+
+    def execute( self, context ):
+        drv_sk_props = context.scene.corrective_drivenkeys_props
+
+        preset = drv_sk_props.channel_presets[ drv_sk_props.preset_name ]
+
+        # Whole arrays are written at once
+        drv_sk_props.channels    = preset.channels[:]
+        drv_sk_props.channel_max = preset.channel_max[:]
+
+        return {'FINISHED'}
+
+
+class correctiveDrivenkeysProps( bpy.types.PropertyGroup ):
+    # These two will be used to select existing objects
+    # and shapekeys to add drivers to
+    mesh_object     = bpy.props.StringProperty()
+    update_shapekey = bpy.props.StringProperty()
+
+    # Type of driver to add to the shapekey
+    driver_type_items = [
+        ('CHANNELS',   'Channels',   'Average of the bone\'s transform channels'),
+        ('POSE_SPACE', 'Pose space', 'RBF interpolation between sample poses')
+    ]
+    driver_type = bpy.props.EnumProperty(
+        name    = "Driver Type",
+        items   = driver_type_items,
+        default = 'CHANNELS'
     )
-    rotZ = bpy.props.BoolProperty(
-        name        = "rotZ",
-        description = "use Z rotation (degrees) for driving the shapekey", 
-        default     = False
+
+    # Sculpt of the mesh in the current pose, to extract a corrective from
+    sculpt_object = bpy.props.StringProperty()
+
+    # Pose library pose to add as a pose space sample
+    pose_marker = bpy.props.StringProperty()
+    
+    # Driver options: which transform channels drive the shapekey, and the
+    # value of each for full shapekey activation (rotations in degrees), in
+    # channel_names order
+    channels = bpy.props.BoolVectorProperty(
+        name        = "channels",
+        description = "use this transform channel for driving the shapekey",
+        size        = len( channel_names ),
+        update      = channel_spec_update
     )
-    rotZmax = bpy.props.FloatProperty(
-        name        = "rotZmax", 
+    channel_max = bpy.props.FloatVectorProperty(
+        name        = "channel_max",
         description = "value for full shapekey activation",
-        subtype     = 'ANGLE'
+        size        = len( channel_names ),
+        update      = channel_spec_update
     )
-    sclX = bpy.props.BoolProperty(
-        name        = "sclX",
-        description = "use X scale for driving the shapekey", 
-        default     = False
-    )
-    sclXmax = bpy.props.FloatProperty(
-        name        = "sclXmax", 
-        description = "value for full shapekey activation" 
-    )
-    sclY = bpy.props.BoolProperty(
-        name        = "sclY",
-        description = "use Y scale for driving the shapekey", 
-        default     = False
-    )
-    sclYmax = bpy.props.FloatProperty(
-        name        = "sclYmax", 
-        description = "value for full shapekey activation" 
-    )
-    sclZ = bpy.props.BoolProperty(
-        name        = "sclZ",
-        description = "use Z scale for driving the shapekey", 
-        default     = False
+
+    # Saved channel setups, and the name of the one to save or load
+    channel_presets = bpy.props.CollectionProperty( type = ChannelPreset )
+    preset_name     = bpy.props.StringProperty( name = "Preset" )
+
+    # Shape of the shapekey's response to the driving channels
+    response_items = [
+        ('LINEAR',     'Linear',     'Value grows linearly up to the max values'),
+        ('CLAMP',      'Clamp',      'Linear, clamped between 0 and 1'),
+        ('SMOOTHSTEP', 'Smoothstep', 'Eases in and out, clamped between 0 and 1'),
+        ('EASE_IN',    'Ease in',    'Starts slow, clamped between 0 and 1'),
+        ('EASE_OUT',   'Ease out',   'Ends slow, clamped between 0 and 1'),
+        ('CUSTOM',     'Custom',     'Custom expression of x, baked into the curve')
+    ]
+    response = bpy.props.EnumProperty(
+        name    = "Response",
+        items   = response_items,
+        default = 'LINEAR'
     )
-    sclZmax = bpy.props.FloatProperty(
-        name        = "sclZmax", 
-        description = "value for full shapekey activation" 
+    response_expression = bpy.props.StringProperty(
+        name        = "f(x)",
+        description = "custom response (numbers, arithmetic, math functions and constants, min, max, abs), x is 0 at rest and 1 at the max values",
+        default     = "x"
     )
 
     # Create a matching shapekey and driver for the opposite bone
@@ -405,14 +1985,65 @@ class correctiveDrivenkeysProps( bpy.types.PropertyGroup ):
         default     = False
     )
 
+    # Mute low impact correctives during playback (restored for renders)
+    simplify = bpy.props.BoolProperty(
+        name        = "Simplify correctives",
+        description = "mute correctives below the chosen impact tier",
+        default     = False,
+        update      = simplify_update
+    )
+    simplify_tier = bpy.props.IntProperty(
+        name        = "Minimum tier",
+        description = "correctives below this impact tier are muted",
+        default     = 2,
+        min         = 0,
+        max         = len( impact_thresholds ),
+        update      = simplify_update
+    )
+
+    # Compute the weight once on the rig, to be shared by several meshes
+    multi_target = bpy.props.BoolProperty(
+        name        = "multi_target",
+        description = "drive the shapekey through a rig property that other meshes can share",
+        default     = False
+    )
+
 
 def register():
     bpy.utils.register_module(__name__)
     bpy.types.Scene.corrective_drivenkeys_props = bpy.props.PointerProperty( 
         type = correctiveDrivenkeysProps )
+    bpy.types.Object.pose_space = bpy.props.PointerProperty(
+        type = PoseSpaceProps )
+
+    bpy.app.handlers.load_post.append( pose_space_load )
+    bpy.app.handlers.load_post.append( driver_index_load )
+    bpy.app.handlers.load_post.append( channel_spec_reset )
+    bpy.app.handlers.undo_post.append( channel_spec_reset )
+    bpy.app.handlers.redo_post.append( channel_spec_reset )
+    bpy.app.handlers.undo_post.append( pose_space_undo )
+    bpy.app.handlers.redo_post.append( pose_space_undo )
+    bpy.app.handlers.render_pre.append( simplify_render_pre )
+    bpy.app.handlers.render_post.append( simplify_render_post )
+    bpy.app.handlers.save_pre.append( simplify_save_pre )
+    bpy.app.handlers.save_post.append( simplify_save_post )
+    bpy.app.driver_namespace['pose_space'] = pose_space
     
 def unregister():
     bpy.utils.unregister_module(__name__)
 
+    bpy.app.handlers.load_post.remove( pose_space_load )
+    bpy.app.handlers.load_post.remove( driver_index_load )
+    bpy.app.handlers.load_post.remove( channel_spec_reset )
+    bpy.app.handlers.undo_post.remove( channel_spec_reset )
+    bpy.app.handlers.redo_post.remove( channel_spec_reset )
+    bpy.app.handlers.undo_post.remove( pose_space_undo )
+    bpy.app.handlers.redo_post.remove( pose_space_undo )
+    bpy.app.handlers.render_pre.remove( simplify_render_pre )
+    bpy.app.handlers.render_post.remove( simplify_render_post )
+    bpy.app.handlers.save_pre.remove( simplify_save_pre )
+    bpy.app.handlers.save_post.remove( simplify_save_post )
+    bpy.app.driver_namespace.pop( 'pose_space', None )
+
 # Registers the class and panel when you run the script from the text editor
 # bpy.utils.register_module(__name__)
@@ -0,0 +1,272 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+#
+#  Author            : Tamir Lousky [ tlousky@gmail.com, tamir@pitchipoy.tv ]
+#
+#  Homepage(Wiki)    : http://bioblog3d.wordpress.com/
+#  Studio (sponsor)  : Pitchipoy Animation Productions (www.pitchipoy.tv)
+#
+#  Acknowledgements
+#  ================
+#
+
+bl_info = {
+    "name"       : "Pose Dataset Export",
+    "author"     : "Tamir Lousky",
+    "version"    : (0, 0, 1),
+    "blender"    : (2, 68, 0),
+    "category"   : "Import-Export",
+    "location"   : "File >> Export >> Pose Dataset",
+    "wiki_url"   : "",
+    "tracker_url": "",
+    "description": "Export sampled poses and corrective weights as numpy arrays"
+}
+
+""" Samples a rig over its actions and exports, for every frame, the local
+transforms of all pose bones and the values of the driven corrective
+shapekeys (see driven_keys_exp.py) of the selected meshes. The data is meant
+for offline analysis and for fitting correctives outside blender.
+
+The export is made of three files:
+1. <name>.json         : schema (bones, shapekeys, actions and array layouts)
+2. <name>_poses.npy    : float32 (frames, bones, 16), each bone's matrix_basis
+                         in row major order, so reshaping to (4, 4) gives
+                         the matrix with the translation in the last column
+3. <name>_weights.npy  : float32 (frames, shapekeys)
+
+Both arrays are memory mapped and filled chunk by chunk, with all values read
+in bulk, so memory use stays the same however many frames are exported.
+
+In background mode (drivers using python expressions need -y):
+
+    blender -b -y character.blend --python pose_dataset_export.py -- \\
+        <rig name> <output.json> [<mesh name> ...]
+"""
+
+import bpy, json, os, sys
+import numpy as np
+from bpy_extras.io_utils import ExportHelper
+from contextlib import contextmanager
+
+try:
+    # Correctives muted by driven_keys_exp.py's simplify must be baked too
+    from driven_keys_exp import all_correctives
+except ImportError:
+    @contextmanager
+    def all_correctives( scene ):
+        yield
+
+# Number of frames gathered in memory before being written out
+chunk_size = 256
+
+def rig_actions( rig ):
+    ''' Returns the actions animating the rig's pose bones '''
+    bones   = rig.pose.bones
+    actions = []
+
+    for a in bpy.data.actions:
+        for fc in a.fcurves:
+            path = fc.data_path
+            if path.startswith( 'pose.bones["' ) and path.split( '"' )[1] in bones:
+                actions.append( a )
+                break
+
+    return actions
+
+def driven_shapekeys( obj ):
+    ''' Returns the indices and names of the mesh's driven shapekeys '''
+    key = obj.data.shape_keys
+    if not key or not key.animation_data:
+        return [], []
+
+    paths   = set( fc.data_path for fc in key.animation_data.drivers )
+    indices = [
+        i for i, kb in enumerate( key.key_blocks )
+        if kb.path_from_id( 'value' ) in paths
+    ]
+
+    return indices, [ key.key_blocks[ i ].name for i in indices ]
+
+def row_major( chunk ):
+    ''' Turns a chunk of matrices as read by foreach_get (column major, one
+        column after the other) into ( frames, bones, 16 ) row major ones '''
+    frames  = len( chunk )
+    columns = chunk.reshape( frames, -1, 4, 4 )
+
+    return columns.transpose( 0, 1, 3, 2 ).reshape( frames, -1, 16 )
+
+def export_pose_dataset( scene, rig, meshes, actions, filepath ):
+    ''' Samples every frame of the actions on the rig and streams the bones'
+        local matrices and the meshes' driven shapekey values to disk '''
+    stem  = os.path.splitext( filepath )[0]
+    bones = [ pb.name for pb in rig.pose.bones ]
+
+    columns = []
+    for obj in meshes:
+        indices, names = driven_shapekeys( obj )
+        if indices:
+            columns.append( ( obj, np.array( indices ), names ) )
+
+    shapekeys = [ obj.name + ':' + n for obj, i, names in columns for n in names ]
+
+    ranges = [ ( a, int( a.frame_range[0] ), int( a.frame_range[1] ) ) for a in actions ]
+    frames = sum( end - start + 1 for a, start, end in ranges )
+
+    poses = np.lib.format.open_memmap(
+        stem + '_poses.npy', mode = 'w+', dtype = np.float32,
+        shape = ( frames, len( bones ), 16 )
+    )
+    weights = np.lib.format.open_memmap(
+        stem + '_weights.npy', mode = 'w+', dtype = np.float32,
+        shape = ( frames, len( shapekeys ) )
+    )
+
+    # Reused buffers: one chunk of frames, and one frame of key values
+    pose_chunk   = np.empty( ( chunk_size, len( bones ) * 16 ), dtype = np.float32 )
+    weight_chunk = np.empty( ( chunk_size, len( shapekeys ) ), dtype = np.float32 )
+    key_values   = {
+        obj.name : np.empty( len( obj.data.shape_keys.key_blocks ), dtype = np.float32 )
+        for obj, i, n in columns
+    }
+
+    schema_actions = []
+
+    anim    = rig.animation_data_create()
+    action  = anim.action
+    current = scene.frame_current
+
+    row, filled = 0, 0
+
+    # Simplified correctives are muted for playback only
+    with all_correctives( scene ):
+        try:
+            for a, start, end in ranges:
+                schema_actions.append( {
+                    'name'        : a.name,
+                    'frame_start' : start,
+                    'frame_end'   : end,
+                    'offset'      : row + filled
+                } )
+
+                anim.action = a
+
+                for frame in range( start, end + 1 ):
+                    scene.frame_set( frame )
+
+                    rig.pose.bones.foreach_get( 'matrix_basis', pose_chunk[ filled ] )
+
+                    col = 0
+                    for obj, indices, names in columns:
+                        values = key_values[ obj.name ]
+                        obj.data.shape_keys.key_blocks.foreach_get( 'value', values )
+
+                        weight_chunk[ filled, col : col + len( indices ) ] = values[ indices ]
+                        col += len( indices )
+
+                    filled += 1
+                    if filled == chunk_size:
+                        poses[ row : row + filled ]   = row_major( pose_chunk )
+                        weights[ row : row + filled ] = weight_chunk
+                        poses.flush()
+                        weights.flush()
+                        row, filled = row + filled, 0
+
+            if filled:
+                poses[ row : row + filled ]   = row_major( pose_chunk[ :filled ] )
+                weights[ row : row + filled ] = weight_chunk[ :filled ]
+        finally:
+            poses.flush()
+            weights.flush()
+            del poses, weights
+
+            anim.action = action
+            scene.frame_set( current )
+
+    schema = {
+        'rig'       : rig.name,
+        'frames'    : frames,
+        'bones'     : bones,
+        'shapekeys' : shapekeys,
+        'actions'   : schema_actions,
+        'poses'     : {
+            'file'   : os.path.basename( stem + '_poses.npy' ),
+            'shape'  : [ frames, len( bones ), 16 ],
+            'layout' : 'pose bone matrix_basis, 4x4 row major (reshape to 4, 4)'
+        },
+        'weights'   : {
+            'file'   : os.path.basename( stem + '_weights.npy' ),
+            'shape'  : [ frames, len( shapekeys ) ],
+            'layout' : 'driven shapekey values, columns named <mesh>:<shapekey>'
+        }
+    }
+
+    with open( stem + '.json', 'w' ) as f:
+        json.dump( schema, f, indent = 4 )
+
+
+class ExportPoseDataset( bpy.types.Operator, ExportHelper ):
+    """ Export the active rig's sampled poses and the selected meshes' corrective weights """
+    bl_idname      = "export_anim.pose_dataset"
+    bl_label       = "Export Pose Dataset"
+    bl_description = "Export the active rig's poses and the selected meshes' corrective weights"
+    bl_options     = { 'REGISTER' }
+
+    filename_ext = ".json"
+
+    @classmethod
+    def poll( self, context ):
+        obj = context.active_object
+        return obj is not None and obj.type == 'ARMATURE'
+
+    def execute( self, context ):
+        rig    = context.active_object
+        meshes = [ o for o in context.selected_objects if o.type == 'MESH' ]
+
+        actions = rig_actions( rig )
+        if not actions:
+            self.report( {'ERROR'}, "No actions animate " + rig.name )
+            return {'CANCELLED'}
+
+        export_pose_dataset( context.scene, rig, meshes, actions, self.filepath )
+
+        return {'FINISHED'}
+
+
+def menu_func( self, context ):
+    self.layout.operator( ExportPoseDataset.bl_idname, text = "Pose Dataset" )
+
+def register():
+    bpy.utils.register_module(__name__)
+    bpy.types.INFO_MT_file_export.append( menu_func )
+
+def unregister():
+    bpy.utils.unregister_module(__name__)
+    bpy.types.INFO_MT_file_export.remove( menu_func )
+
+if __name__ == "__main__":
+    # Background mode: arguments come after '--' on blender's command line
+    args = sys.argv[ sys.argv.index( '--' ) + 1: ] if '--' in sys.argv else []
+
+    if len( args ) >= 2:
+        rig    = bpy.data.objects[ args[0] ]
+        meshes = [ bpy.data.objects[ name ] for name in args[2:] ]
+
+        export_pose_dataset(
+            bpy.context.scene, rig, meshes, rig_actions( rig ), args[1]
+        )
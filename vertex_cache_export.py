@@ -0,0 +1,221 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+#
+#  Author            : Tamir Lousky [ tlousky@gmail.com, tamir@pitchipoy.tv ]
+#
+#  Homepage(Wiki)    : http://bioblog3d.wordpress.com/
+#  Studio (sponsor)  : Pitchipoy Animation Productions (www.pitchipoy.tv)
+#
+#  Acknowledgements
+#  ================
+#
+
+bl_info = {
+    "name"       : "Vertex Cache Export",
+    "author"     : "Tamir Lousky",
+    "version"    : (0, 0, 1),
+    "blender"    : (2, 68, 0),
+    "category"   : "Import-Export",
+    "location"   : "File >> Export >> Vertex Cache",
+    "wiki_url"   : "",
+    "tracker_url": "",
+    "description": "Export deformed meshes (rig, drivers, shapekeys) to a point cache"
+}
+
+""" Bake the final, deformed vertex positions of a mesh (armature, driven
+corrective shapekeys and other modifiers) into a point cache, so that render
+nodes can read the cache with a Mesh Cache modifier instead of evaluating the
+rig and its drivers.
+
+Two layouts are supported:
+1. PC2, the point cache format read by the Mesh Cache modifier
+2. A raw .npy array of shape (frames, vertices, 3)
+
+Frames are streamed one by one into a memory mapped file through a single,
+reused buffer, so memory use doesn't grow with the length of the shot.
+
+To run on the farm in background mode (drivers using python expressions,
+like the pose space correctives, need auto-run scripts enabled with -y):
+
+    blender -b -y shot.blend --python vertex_cache_export.py -- \\
+        <object name> <output path> [<start frame> <end frame>]
+"""
+
+import bpy, os, struct, sys
+import numpy as np
+from bpy_extras.io_utils import ExportHelper
+from contextlib import contextmanager
+
+try:
+    # Correctives muted by driven_keys_exp.py's simplify must be baked too
+    from driven_keys_exp import all_correctives
+except ImportError:
+    @contextmanager
+    def all_correctives( scene ):
+        yield
+
+# PC2 header: signature, version, points, start frame, sample rate, samples
+pc2_header = '<12siiffi'
+
+def open_cache( filepath, cache_format, frames, points, frame_start ):
+    ''' Creates the cache file and returns it as a (frames, points, 3)
+        memory mapped float32 array '''
+    shape = ( frames, points, 3 )
+
+    if cache_format == 'NPY':
+        return np.lib.format.open_memmap(
+            filepath, mode = 'w+', dtype = np.float32, shape = shape
+        )
+
+    header = struct.pack(
+        pc2_header, b'POINTCACHE2\0', 1, points, frame_start, 1.0, frames
+    )
+
+    with open( filepath, 'wb' ) as f:
+        f.write( header )
+
+    return np.memmap(
+        filepath, mode = 'r+', dtype = np.float32,
+        offset = len( header ), shape = shape
+    )
+
+def export_vertex_cache( obj, scene, filepath, frame_start, frame_end,
+                         cache_format = 'PC2', settings = 'RENDER' ):
+    ''' Steps through the frame range and streams the object's evaluated
+        vertex positions (object space) into a point cache file '''
+    frames = frame_end - frame_start + 1
+    points = len( obj.data.vertices )
+
+    cache  = open_cache( filepath, cache_format, frames, points, frame_start )
+    buffer = np.empty( points * 3, dtype = np.float32 )
+
+    current = scene.frame_current
+
+    # Simplified correctives are muted for playback only
+    with all_correctives( scene ):
+        try:
+            for i in range( frames ):
+                # Evaluates the rig, the corrective drivers and the shapekeys
+                scene.frame_set( frame_start + i )
+
+                mesh = obj.to_mesh( scene, True, settings )
+
+                if len( mesh.vertices ) != points:
+                    bpy.data.meshes.remove( mesh )
+                    raise RuntimeError(
+                        "%s changes vertex count at frame %d" % (
+                            obj.name, frame_start + i
+                        )
+                    )
+
+                mesh.vertices.foreach_get( 'co', buffer )
+                bpy.data.meshes.remove( mesh )
+
+                cache[ i ] = buffer.reshape( points, 3 )
+
+                # Write pages out regularly rather than holding them all in RAM
+                if i % 100 == 99:
+                    cache.flush()
+        finally:
+            cache.flush()
+            del cache
+            scene.frame_set( current )
+
+
+class ExportVertexCache( bpy.types.Operator, ExportHelper ):
+    """ Export the active mesh's deformed vertices to a point cache """
+    bl_idname      = "export_shape.vertex_cache"
+    bl_label       = "Export Vertex Cache"
+    bl_description = "Export the active mesh's deformed vertices to a point cache"
+    bl_options     = { 'REGISTER' }
+
+    filename_ext = ".pc2"
+
+    cache_format_items = [
+        ('PC2', 'PC2', 'Point cache, readable by the Mesh Cache modifier'),
+        ('NPY', 'NPY', 'Raw numpy array of shape (frames, vertices, 3)')
+    ]
+    cache_format = bpy.props.EnumProperty(
+        name    = "Format",
+        items   = cache_format_items,
+        default = 'PC2'
+    )
+
+    settings_items = [
+        ('RENDER',  'Render',  'Use render modifier settings'),
+        ('PREVIEW', 'Preview', 'Use viewport modifier settings')
+    ]
+    settings = bpy.props.EnumProperty(
+        name    = "Modifier settings",
+        items   = settings_items,
+        default = 'RENDER'
+    )
+
+    @classmethod
+    def poll( self, context ):
+        obj = context.active_object
+        return obj is not None and obj.type == 'MESH'
+
+    def execute( self, context ):
+        scene    = context.scene
+        filepath = self.filepath
+
+        # Replace the default .pc2 extension rather than appending to it
+        if self.cache_format == 'NPY' and not filepath.endswith( '.npy' ):
+            filepath = os.path.splitext( filepath )[0] + '.npy'
+
+        try:
+            export_vertex_cache(
+                context.active_object, scene, filepath,
+                scene.frame_start, scene.frame_end,
+                self.cache_format, self.settings
+            )
+        except RuntimeError as e:
+            self.report( {'ERROR'}, str( e ) )
+            return {'CANCELLED'}
+
+        return {'FINISHED'}
+
+
+def menu_func( self, context ):
+    self.layout.operator( ExportVertexCache.bl_idname, text = "Vertex Cache" )
+
+def register():
+    bpy.utils.register_module(__name__)
+    bpy.types.INFO_MT_file_export.append( menu_func )
+
+def unregister():
+    bpy.utils.unregister_module(__name__)
+    bpy.types.INFO_MT_file_export.remove( menu_func )
+
+if __name__ == "__main__":
+    # Background mode: arguments come after '--' on blender's command line
+    args = sys.argv[ sys.argv.index( '--' ) + 1: ] if '--' in sys.argv else []
+
+    if len( args ) >= 2:
+        scene = bpy.context.scene
+        obj   = scene.objects[ args[0] ]
+
+        start, end = scene.frame_start, scene.frame_end
+        if len( args ) >= 4:
+            start, end = int( args[2] ), int( args[3] )
+
+        cache_format = 'NPY' if args[1].endswith( '.npy' ) else 'PC2'
+
+        export_vertex_cache( obj, scene, args[1], start, end, cache_format )